@@ -1,51 +1,177 @@
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, jsonify, request, g, Response
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
-from sklearn.metrics.pairwise import cosine_similarity
 import matplotlib.pyplot as plt
+import argparse
+import fcntl
 import io
 import base64
 import json
 import os
+import hashlib
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+import vector_index
+import search_index
+import filter_index
+import artifacts
+import catalog
+import compact
+import training
+import model_selection as selection
+import hot_reload
+import metrics
+import profiler
+import serialization
+from cache import TTLCache
 
 app = Flask(__name__)
 CORS(app)
 
-# Global variables to store processed data
+# Global variables to store processed data; df holds the compact column types
+# of compact_songs
 df = None
-df_scaled = None
+df_scaled = None  # DataFrame view of scaled_features
 scaler = None
 kmeans = None
+ann_index = None
+model_version = None  # artifact version, or "live" when trained in process
+
+# Hot-path arrays derived from df/df_scaled once per model load
+scaled_features = None  # float32 scaled features, one row per song
+song_vectors = None  # scaled_features with unit-length rows
+song_names = None
+song_columns = None  # response columns as NumPy arrays, see build_song_columns
+song_id_index = None  # stable song id -> row, see compact.build_string_index
+song_search_index = None  # trigram index over names and artists
+song_filter_index = None  # year, popularity and artist indexes for filtered recommendations
+model_drift = None  # cluster fit of the trained songs and of songs ingested since
+model_selection = None  # k sweep behind N_CLUSTERS, when `build --select-k` ran one
+cluster_summary = None  # cluster statistics and the pages rendered from them, see build_cluster_summary
+ingest_log_offset = 0  # bytes of INGEST_LOG replayed into the served model
 numerical_features = ["valence", "danceability", "energy", "tempo", "acousticness", "liveness", "speechiness", "instrumentalness"]
+catalog_columns = ["id", "name", "artists", "year", "popularity"] + numerical_features
+string_columns = ("id", "name", "artists")
+
+# Columnar catalog written by `python app.py convert`; read instead of the CSV
+# when present
+CATALOG_PATH = os.environ.get("CATALOG_PATH", "catalog")
+
+# Songs sampled from the catalog at load time; 0 loads the full catalog and
+# trains with streaming passes of TRAIN_CHUNKSIZE rows
+SAMPLE_SIZE = int(os.environ.get("SAMPLE_SIZE", "5000"))
+TRAIN_CHUNKSIZE = int(os.environ.get("TRAIN_CHUNKSIZE", "100000"))
+TRAIN_EPOCHS = int(os.environ.get("TRAIN_EPOCHS", "1"))
+
+# Number of song clusters; `python app.py select-k` sweeps candidates for it
+N_CLUSTERS = int(os.environ.get("N_CLUSTERS", "5"))
+
+# Finished fits of `select-k` sweeps, reused by later sweeps over the same data
+SELECTION_CACHE = os.environ.get("SELECTION_CACHE", "selection_cache")
+
+# Nearest-neighbour search knobs: "ivf" scores only the ANN_PROBES clusters
+# nearest to the query song, "exact" scans the whole catalog (for verification).
+# Clusters after the nearest are skipped when their centroid is more than
+# ANN_PROBE_RATIO times as far away (0 disables), so only songs near a cluster
+# boundary pay for extra clusters
+ANN_MODE = os.environ.get("ANN_MODE", "ivf")
+ANN_PROBES = int(os.environ.get("ANN_PROBES", "3"))
+ANN_PROBE_RATIO = float(os.environ.get("ANN_PROBE_RATIO", "1.3"))
+
+# ANN_QUANTIZE=int8 keeps the probed lists as int8 codes (a quarter of the
+# float32 memory) and scores them approximately, re-scoring the best
+# ANN_RERANK x k candidates from the float vectors
+ANN_QUANTIZE = os.environ.get("ANN_QUANTIZE", "none")
+ANN_RERANK = int(os.environ.get("ANN_RERANK", "4"))
+
+# Directory written by `python app.py build`; when set, the server memory-maps
+# the prebuilt model instead of training at startup
+MODEL_ARTIFACTS = os.environ.get("MODEL_ARTIFACTS")
+
+# Without MODEL_ARTIFACTS: the first server process on the box trains the
+# model and publishes it as artifacts under this directory, and every process
+# memory-maps them, so N workers share one copy. A tmpfs such as /dev/shm keeps
+# it off disk
+MODEL_SHARE_DIR = os.environ.get("MODEL_SHARE_DIR")
+
+# Largest number of songs accepted by /api/recommend/batch
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "1000"))
+
+# Largest k (recommendations per song) accepted by the recommendation endpoints
+MAX_RECOMMENDATIONS = int(os.environ.get("MAX_RECOMMENDATIONS", "100"))
+
+# Candidates re-ranked when a request asks for diversity or an artist cap
+DIVERSITY_POOL = int(os.environ.get("DIVERSITY_POOL", "500"))
+
+# Largest number of seed songs accepted by /api/recommend/playlist
+MAX_PLAYLIST_SEEDS = int(os.environ.get("MAX_PLAYLIST_SEEDS", "1000"))
+
+# Response caches for /api/recommend and /api/search, emptied on every model load.
+# They hold encoded response bodies, so hits skip serialization
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "300"))
+recommend_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+search_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+# Held for reading by every request and for writing while a new model is
+# installed, so requests never see a half-swapped model
+model_lock = hot_reload.ReadWriteLock()
+
+# Shared secret for the /api/admin endpoints, which are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# When > 0 and MODEL_ARTIFACTS or MODEL_SHARE_DIR is set, poll it every this
+# many seconds and hot-reload when its LATEST version changes
+RELOAD_WATCH_INTERVAL = float(os.environ.get("RELOAD_WATCH_INTERVAL", "0"))
+
+# Largest number of songs accepted per /api/admin/ingest request
+MAX_INGEST_SIZE = int(os.environ.get("MAX_INGEST_SIZE", "10000"))
+
+# When set, songs sent to /api/admin/ingest are appended to this JSON-lines
+# file, and every model loaded, reloaded or built replays them, so ingested
+# songs survive reloads and reach every worker sharing the file on its next load
+INGEST_LOG = os.environ.get("INGEST_LOG")
+
+# Reclustering is recommended once ingested songs sit this many times further
+# from their centroids than the trained songs did (mean squared distance), or
+# once the cluster size distribution has moved by this total variation distance
+DRIFT_INERTIA_RATIO = float(os.environ.get("DRIFT_INERTIA_RATIO", "1.5"))
+DRIFT_SIZE_SHIFT = float(os.environ.get("DRIFT_SIZE_SHIFT", "0.1"))
+
+# Metrics served at /metrics
+request_latency = metrics.Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ("method", "route", "status")
+)
+recommend_stage_latency = metrics.Histogram(
+    "recommend_stage_duration_seconds",
+    "Time spent per recommendation stage: lookup, filter, candidates, scoring, results, serialization",
+    ("stage",)
+)
+recommend_errors = metrics.Counter("recommend_errors_total", "Recommendations that failed with an exception")
+
+# When PROFILE_SLOW_MS > 0, requests slower than that many milliseconds have
+# their sampled stacks written to PROFILE_DIR; toggled at /api/admin/profiler.
+# Enabled there without a threshold, it keeps requests over PROFILE_DEFAULT_MS
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_DEFAULT_MS = 500
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+request_profiler = profiler.SlowRequestProfiler(
+    (PROFILE_SLOW_MS if PROFILE_SLOW_MS > 0 else PROFILE_DEFAULT_MS) / 1000, PROFILE_INTERVAL_MS / 1000, PROFILE_DIR
+)
+if PROFILE_SLOW_MS > 0:
+    request_profiler.enable()
 
 def load_and_process_data():
     """Load and process the music data"""
-    global df, df_scaled, scaler, kmeans
-    
     try:
-        # Load data
-        df = pd.read_csv("data.csv.zip")  # Adjust path as needed
-        df = df.sample(n=5000, random_state=42).reset_index(drop=True)
-        
-        # Scale features
-        scaler = StandardScaler()
-        df_scaled = pd.DataFrame(
-            scaler.fit_transform(df[numerical_features]), 
-            columns=numerical_features
-        )
-        
-        # Train clustering model
-        train_data, test_data = train_test_split(df_scaled, test_size=0.2, random_state=42)
-        
-        # Use optimal k=5 based on elbow method
-        optimal_k = 5
-        kmeans = KMeans(n_clusters=optimal_k, random_state=42, n_init=10)
-        df["Cluster"] = kmeans.fit_predict(df_scaled)
+        install_model(train_model())
         
         print(f"Data loaded successfully! {len(df)} songs processed.")
         print(f"Cluster distribution:\n{df['Cluster'].value_counts()}")
@@ -61,10 +187,102 @@ def load_and_process_data():
         create_sample_data()
         return False
 
+def catalog_source():
+    """Return the columnar catalog at CATALOG_PATH if there is one, else the CSV"""
+    return CATALOG_PATH if catalog.is_catalog(CATALOG_PATH) else "data.csv.zip"  # Adjust path as needed
+
+def training_source():
+    """Describe the catalog file and settings a trained model depends on"""
+    source = catalog_source()
+    path = os.path.join(source, catalog.MANIFEST_FILE) if catalog.is_catalog(source) else source
+    stat = os.stat(path) if os.path.exists(path) else None
+    return {
+        "path": os.path.abspath(path),
+        "modified_ns": stat and stat.st_mtime_ns,
+        "bytes": stat and stat.st_size,
+        "sample_size": SAMPLE_SIZE,
+        "clusters": N_CLUSTERS,
+        "chunksize": TRAIN_CHUNKSIZE,
+        "epochs": TRAIN_EPOCHS,
+    }
+
+def selected_centroids():
+    """Return the centroids of the k sweep's chosen fit if it chose N_CLUSTERS, else None"""
+    if model_selection and model_selection["k"] == N_CLUSTERS and "centroids" in model_selection:
+        return np.array(model_selection["centroids"])
+    return None
+
+def train_model():
+    """Train a model snapshot from the catalog without touching the served model
+    
+    After a k sweep (`build --select-k`) the clustering starts from the
+    chosen fit, so the model shipped is the one the sweep scored.
+    """
+    source = catalog_source()
+    init = selected_centroids()
+
+    if SAMPLE_SIZE:
+        df = read_songs(source, SAMPLE_SIZE)
+        
+        # Scale features
+        scaler = StandardScaler()
+        df_scaled = pd.DataFrame(
+            scaler.fit_transform(df[numerical_features]), 
+            columns=numerical_features
+        )
+        
+        # Train clustering model
+        kmeans = KMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=10)
+        if init is not None:
+            kmeans.set_params(init=init, n_init=1)
+        df["Cluster"] = kmeans.fit_predict(df_scaled)
+    else:
+        # Fit scaler and clusters over the full catalog in bounded memory
+        scaler, kmeans, labels = training.fit_streaming(
+            source, numerical_features, N_CLUSTERS,
+            chunksize=TRAIN_CHUNKSIZE, epochs=TRAIN_EPOCHS, init=init
+        )
+        df = read_songs(source)
+        df_scaled = pd.DataFrame(
+            scaler.transform(df[numerical_features].to_numpy()),
+            columns=numerical_features
+        )
+        df["Cluster"] = labels
+    
+    return build_snapshot(df, df_scaled, scaler, kmeans, "live")
+
+def sweep_clusters(ks, seeds=(42,), sample_size=None, silhouette_sample=10_000,
+                   criterion="elbow", workers=None):
+    """Sweep cluster counts over a sample of the catalog; see model_selection.select_k
+    
+    sample_size defaults to SAMPLE_SIZE, so the sweep scores the rows training uses.
+    """
+    sample_size = SAMPLE_SIZE if sample_size is None else sample_size
+    songs = read_songs(catalog_source(), sample_size or None)
+    features = StandardScaler().fit_transform(songs[numerical_features])
+    result = selection.select_k(features, ks, seeds, silhouette_sample, criterion, workers, SELECTION_CACHE)
+    return dict(result, sample_size=sample_size)
+
+def read_songs(source, sample_size=None):
+    """Read the catalog columns from a columnar catalog or CSV, optionally sampled"""
+    if catalog.is_catalog(source):
+        rows = None
+        if sample_size:
+            total_rows = catalog.read_manifest(source)["rows"]
+            # Same rows as DataFrame.sample(n=sample_size, random_state=42)
+            rows = np.random.RandomState(42).choice(total_rows, size=sample_size, replace=False)
+        # Older catalogs may lack optional columns such as id
+        columns = [column for column in catalog_columns
+                   if column in catalog.read_manifest(source)["columns"]]
+        return catalog.read_catalog(source, columns=columns, rows=rows)
+    
+    songs = pd.read_csv(source, usecols=lambda column: column in catalog_columns)
+    if sample_size:
+        songs = songs.sample(n=sample_size, random_state=42).reset_index(drop=True)
+    return songs
+
 def create_sample_data():
     """Create sample data for demonstration"""
-    global df, df_scaled, scaler, kmeans
-    
     # Sample data
     sample_data = {
         'name': [
@@ -107,50 +325,842 @@ def create_sample_data():
     # Create clusters
     kmeans = KMeans(n_clusters=5, random_state=42, n_init=10)
     df["Cluster"] = kmeans.fit_predict(df_scaled)
+    install_model(build_snapshot(df, df_scaled, scaler, kmeans, "sample"))
     
     print("Sample data created successfully!")
 
-def recommend_songs(song_name, num_recommendations=5):
-    """Recommend songs based on clustering and similarity"""
+def build_snapshot(df, df_scaled, scaler, kmeans, version):
+    """Precompute the feature matrices, nearest-neighbour and search indexes
+    
+    Returns a model snapshot (a dict keyed by global name) for install_model.
+    """
+    assign_song_ids(df)
+    df = compact_songs(df)
+    
+    scaled_features = np.ascontiguousarray(
+        df_scaled[numerical_features].to_numpy(), dtype=np.float32
+    )
+    df_scaled = pd.DataFrame(scaled_features, columns=numerical_features, copy=False)
+    song_vectors = vector_index.normalize_rows(scaled_features)
+    columns = build_song_columns(df)
+    
+    ann_index = configure_ann_index(vector_index.build_ivf_index(
+        song_vectors,
+        kmeans.cluster_centers_,
+        df["Cluster"].to_numpy()
+    ))
+    
+    return {
+        "df": df,
+        "df_scaled": df_scaled,
+        "scaler": scaler,
+        "kmeans": kmeans,
+        "model_version": version,
+        "ann_index": ann_index,
+        "scaled_features": scaled_features,
+        "song_vectors": song_vectors,
+        "song_names": columns["name"],
+        "song_columns": columns,
+        "song_id_index": compact.build_string_index(columns["id"]),
+        "song_search_index": search_index.build_search_index(df['name'], df['artists']),
+        "song_filter_index": build_song_filter_index(df),
+        "model_drift": drift_baseline(ann_index, scaled_features, df["Cluster"].to_numpy()),
+        "cluster_summary": build_cluster_summary(df),
+    }
+
+def install_model(snapshot):
+    """Atomically make snapshot the served model
+    
+    Waits for in-flight requests to finish on the current model; requests that
+    arrive meanwhile start on the new one.
+    """
+    global df, df_scaled, scaler, kmeans, model_version
+    global ann_index, scaled_features, song_vectors, song_names
+    global song_id_index, song_search_index, model_drift, song_columns, song_filter_index, cluster_summary
+    global ingest_log_offset
+    
+    model_lock.acquire_write()
+    try:
+        df = snapshot["df"]
+        df_scaled = snapshot["df_scaled"]
+        scaler = snapshot["scaler"]
+        kmeans = snapshot["kmeans"]
+        model_version = snapshot["model_version"]
+        ann_index = snapshot["ann_index"]
+        scaled_features = snapshot["scaled_features"]
+        song_vectors = snapshot["song_vectors"]
+        song_names = snapshot["song_names"]
+        song_columns = snapshot["song_columns"]
+        song_id_index = snapshot["song_id_index"]
+        song_search_index = snapshot["song_search_index"]
+        song_filter_index = snapshot["song_filter_index"]
+        model_drift = snapshot["model_drift"]
+        cluster_summary = snapshot["cluster_summary"]
+        ingest_log_offset = snapshot.get("ingest_log_offset", 0)
+        reset_caches()
+    finally:
+        model_lock.release_write()
+
+def served_snapshot():
+    """Return the served model as a snapshot, the inverse of install_model"""
+    return {
+        "df": df,
+        "df_scaled": df_scaled,
+        "scaler": scaler,
+        "kmeans": kmeans,
+        "model_version": model_version,
+        "ann_index": ann_index,
+        "scaled_features": scaled_features,
+        "song_vectors": song_vectors,
+        "song_names": song_names,
+        "song_columns": song_columns,
+        "song_id_index": song_id_index,
+        "song_search_index": song_search_index,
+        "song_filter_index": song_filter_index,
+        "model_drift": model_drift,
+        "cluster_summary": cluster_summary,
+        "ingest_log_offset": ingest_log_offset,
+    }
+
+def assign_song_ids(df):
+    """Give every song a stable id
+    
+    The dataset's own id column is used when present; otherwise ids are hashed
+    from name, artists and year so they survive resampling and reloads.
+    """
+    if 'id' not in df.columns:
+        seen = {}
+        ids = []
+        for name, artists, year in zip(df['name'], df['artists'], df['year']):
+            song_id = hash_song_id(name, artists, year)
+            # Identical songs get a numbered suffix to keep ids unique
+            seen[song_id] = seen.get(song_id, 0) + 1
+            ids.append(song_id if seen[song_id] == 1 else f"{song_id}-{seen[song_id]}")
+        df['id'] = ids
+
+def hash_song_id(name, artists, year):
+    """Return the stable id hashed from a song's name, artists and year"""
+    key = f"{name}\x1f{artists}\x1f{year}".encode("utf-8")
+    return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+def configure_ann_index(index):
+    """Quantize or unquantize a nearest-neighbour index as ANN_QUANTIZE asks"""
+    if ANN_QUANTIZE == "int8":
+        return index if "list_codes" in index else vector_index.quantize_index(index)
+    return vector_index.unquantize_index(index)
+
+def compact_songs(df):
+    """Return df with the column types kept in memory
+    
+    Ids and names become compact.PackedStrings, artists a categorical (every
+    distinct artists value stored once), year, popularity and Cluster the
+    narrowest integer type holding them and the audio features float32.
+    Columns already in those types are kept as they are.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in ('id', 'name'):
+            values = compact.PackedStrings._from_sequence(values.array)
+        elif column == 'artists':
+            values = values.astype('category')
+        elif column in numerical_features:
+            values = values.to_numpy(dtype=np.float32)
+        elif column in ('year', 'popularity', 'Cluster'):
+            values = values.to_numpy()
+            values = values.astype(compact.smallest_int_dtype(values), copy=False)
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+def build_song_columns(df):
+    """Return the columns served in API responses as arrays, for gathering rows
+    
+    Ids and names stay PackedStrings and artists a Categorical; indexing any
+    of them with an array of rows returns those rows.
+    """
+    columns = {column: df[column].array for column in ('id', 'name', 'artists')}
+    columns.update({column: df[column].to_numpy() for column in ('year', 'Cluster')})
+    return columns
+
+def artist_codes(count, artist_rows, artist_offsets):
+    """Return each row's artists code from the CSR artist rows of a filter index"""
+    codes = np.empty(len(artist_rows), dtype=compact.smallest_int_dtype([count]))
+    codes[artist_rows] = np.repeat(np.arange(count), np.diff(artist_offsets))
+    return codes
+
+def build_song_filter_index(df):
+    """Index years, artists and (when the catalog has it) popularity for filtering"""
+    popularity = df['popularity'] if 'popularity' in df.columns else None
+    return filter_index.build_filter_index(df['year'], df['artists'], popularity)
+
+def cluster_statistics(df):
+    """Return per-cluster song counts, mean audio features and year ranges"""
+    clusters, codes, counts = np.unique(df['Cluster'].to_numpy(), return_inverse=True, return_counts=True)
+    features = df[numerical_features].to_numpy(dtype=np.float64)
+    means = np.stack([np.bincount(codes, weights=features[:, i], minlength=len(clusters))
+                      for i in range(len(numerical_features))], axis=1) / counts[:, None]
+    
+    # Songs grouped by cluster with ascending years, so each group's ends are its range
+    years = df['year'].to_numpy()
+    years = years[np.lexsort((years, codes))]
+    ends = np.cumsum(counts)
+    
+    return [{
+        "cluster": int(cluster),
+        "count": int(count),
+        "year_min": int(years[end - count]),
+        "year_max": int(years[end - 1]),
+        "feature_means": dict(zip(numerical_features, feature_means.tolist())),
+    } for cluster, count, end, feature_means in zip(clusters, counts, ends, means)]
+
+def merge_cluster_statistics(statistics, added):
+    """Return the cluster statistics of two sets of songs from those of each set"""
+    merged = {cluster["cluster"]: cluster for cluster in statistics}
+    for cluster in added:
+        current = merged.get(cluster["cluster"])
+        if current is None:
+            merged[cluster["cluster"]] = cluster
+            continue
+        count = current["count"] + cluster["count"]
+        merged[cluster["cluster"]] = {
+            "cluster": cluster["cluster"],
+            "count": count,
+            "year_min": min(current["year_min"], cluster["year_min"]),
+            "year_max": max(current["year_max"], cluster["year_max"]),
+            "feature_means": {
+                feature: (current["feature_means"][feature] * current["count"]
+                          + cluster["feature_means"][feature] * cluster["count"]) / count
+                for feature in numerical_features
+            },
+        }
+    return [merged[cluster] for cluster in sorted(merged)]
+
+def build_cluster_summary(df, statistics=None, last_modified=None):
+    """Compute the cluster statistics of a model and render the pages showing them
+    
+    Done once per model snapshot; the pages are served with an ETag of their
+    body and last_modified (by default now) as Last-Modified. Models loaded
+    from artifacts pass the version's creation time, so every worker serving
+    it sends the same header. statistics are cluster_statistics(df) when
+    already known.
+    """
+    if statistics is None:
+        statistics = cluster_statistics(df)
+    cluster_data = [{"cluster": cluster["cluster"], "count": cluster["count"]} for cluster in statistics]
+    pages = {
+        "index": index_template.render(
+            total_songs=len(df),
+            total_clusters=len(statistics),
+            cluster_data=json.dumps(cluster_data)
+        ).encode("utf-8"),
+        "cluster_stats": serialization.dumps({
+            "total_songs": len(df),
+            "total_clusters": len(statistics),
+            "cluster_distribution": statistics,
+        }),
+    }
+    return {
+        "statistics": statistics,
+        "pages": pages,
+        "etags": {name: hashlib.blake2b(body, digest_size=16).hexdigest() for name, body in pages.items()},
+        "last_modified": time.time() if last_modified is None else last_modified,
+    }
+
+def reset_caches():
+    """Drop cached responses computed from a previous model"""
+    recommend_cache.clear()
+    search_cache.clear()
+
+def save_model_artifacts(output_dir, source=None):
+    """Persist the current model under output_dir as a new artifact version
+    
+    source (see training_source) is recorded in the metadata when given.
+    """
+    id_bytes, id_offsets = artifacts.encode_strings(df['id'])
+    name_bytes, name_offsets = artifacts.encode_strings(df['name'])
+    artist_bytes, artist_offsets = artifacts.encode_strings(df['artists'])
+    
+    arrays = {
+        "id_bytes": id_bytes,
+        "id_offsets": id_offsets,
+        "name_bytes": name_bytes,
+        "name_offsets": name_offsets,
+        "artist_bytes": artist_bytes,
+        "artist_offsets": artist_offsets,
+        "year": df['year'].to_numpy(),
+        "features": df[numerical_features].to_numpy(dtype=np.float32),
+        "labels": df['Cluster'].to_numpy(dtype=np.int32),
+        "scaler_mean": scaler.mean_,
+        "scaler_scale": scaler.scale_,
+        "scaler_var": scaler.var_,
+        "scaled_features": scaled_features,
+        "search_grams": song_search_index["grams"],
+        "search_offsets": song_search_index["offsets"],
+        "search_postings": song_search_index["postings"],
+    }
+    # Float lists are always written, so the artifacts serve either way
+    for key, value in vector_index.unquantize_index(ann_index).items():
+        arrays[f"ivf_{key}"] = value
+    for key in ("list_codes", "code_low", "code_scale"):
+        if key in ann_index:
+            arrays[f"ivf_{key}"] = ann_index[key]
+    
+    arrays["filter_artist_bytes"], arrays["filter_artist_offsets"] = artifacts.encode_strings(
+        [str(value) for value in song_filter_index["artist_values"]]
+    )
+    arrays["filter_year_order"] = song_filter_index["year_order"]
+    arrays["filter_years_sorted"] = song_filter_index["years_sorted"]
+    arrays["filter_artist_rows"] = song_filter_index["artist_rows"]
+    arrays["filter_artist_row_offsets"] = song_filter_index["artist_offsets"]
+    arrays["filter_artist_codes"] = artist_codes(
+        len(song_filter_index["artist_values"]), song_filter_index["artist_rows"], song_filter_index["artist_offsets"]
+    )
+    if 'popularity' in df.columns:
+        arrays["popularity"] = df['popularity'].to_numpy()
+        arrays["filter_popularity_order"] = song_filter_index["popularity_order"]
+        arrays["filter_popularity_sorted"] = song_filter_index["popularity_sorted"]
+    
+    # Derived indexes are saved too, so loading maps them instead of
+    # rebuilding a private copy in every worker
+    for field, texts in song_search_index["fields"].items():
+        texts = texts.copy()  # offsets rebased to the start of the buffer
+        arrays[f"search_{field}_bytes"], arrays[f"search_{field}_offsets"] = texts.data, texts.offsets
+    arrays["id_hashes"] = song_id_index["hashes"]
+    arrays["id_rows"] = song_id_index["rows"]
+    
+    metadata = {
+        "songs": len(df),
+        "clusters": len(ann_index["centroids"]),
+        "features": numerical_features,
+        "scaler_samples_seen": int(scaler.n_samples_seen_),
+        "source_version": model_version,
+        "drift": model_drift,
+        "model_selection": model_selection,
+    }
+    if source is not None:
+        metadata["training_source"] = source
+    return artifacts.save_artifacts(output_dir, arrays, metadata)
+
+def load_model_artifacts(path):
+    """Serve a prebuilt model by memory-mapping its artifacts"""
+    install_model(read_model_artifacts(path))
+    
+    print(f"Model {model_version} loaded from artifacts! {len(df)} songs.")
+
+def read_model_artifacts(path):
+    """Build a model snapshot by memory-mapping the artifacts at path"""
+    arrays, metadata = artifacts.load_artifacts(path)
+    if metadata["features"] != numerical_features:
+        raise ValueError(f"Artifact features {metadata['features']} do not match {numerical_features}")
+    
+    # Ids and names stay in the memory-mapped buffers
+    names = compact.PackedStrings(arrays["name_bytes"], arrays["name_offsets"])
+    ids = compact.PackedStrings(arrays["id_bytes"], arrays["id_offsets"])
+    
+    # The filter index holds every distinct artists value and its rows, which
+    # is the categorical; older artifacts decode the per-row values
+    if "filter_year_order" in arrays:
+        artist_values = artifacts.decode_strings(arrays["filter_artist_bytes"], arrays["filter_artist_offsets"])
+        artist_offsets = arrays["filter_artist_row_offsets"]
+        codes = arrays.get("filter_artist_codes")
+        if codes is None:
+            codes = artist_codes(len(artist_values), arrays["filter_artist_rows"], artist_offsets)
+        artists = pd.Categorical.from_codes(codes, categories=artist_values)
+    else:
+        artists = artifacts.decode_strings(arrays["artist_bytes"], arrays["artist_offsets"])
+    
+    columns = {"id": ids, "name": names, "artists": artists, "year": arrays["year"]}
+    if "popularity" in arrays:
+        columns["popularity"] = arrays["popularity"]
+    for i, feature in enumerate(numerical_features):
+        columns[feature] = arrays["features"][:, i]
+    columns["Cluster"] = arrays["labels"]
+    # Built in one go without copying, so the columns stay views of the
+    # memory-mapped arrays (assigning a column would copy it)
+    df = compact_songs(pd.DataFrame(columns, copy=False))
+    
+    scaled_features = arrays["scaled_features"]
+    df_scaled = pd.DataFrame(scaled_features, columns=numerical_features, copy=False)
+    
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(arrays["scaler_mean"])
+    scaler.scale_ = np.array(arrays["scaler_scale"])
+    scaler.var_ = np.array(arrays["scaler_var"])
+    scaler.n_samples_seen_ = metadata["scaler_samples_seen"]
+    scaler.n_features_in_ = len(numerical_features)
+    scaler.feature_names_in_ = np.array(numerical_features, dtype=object)
+    kmeans = None  # cluster assignments and centroids come from the artifacts
+    
+    ann_index = {key[len("ivf_"):]: value for key, value in arrays.items() if key.startswith("ivf_")}
+    if ANN_QUANTIZE == "int8" and "list_codes" in ann_index:
+        # Leave the float lists unmapped; only the codes are scanned
+        del ann_index["list_vectors"]
+    ann_index = configure_ann_index(ann_index)
+    columns = build_song_columns(df)
+    
+    # Artifacts written before filtering existed lack the filter index
+    if "filter_year_order" in arrays:
+        song_filter_index = filter_index.restore_filter_index(
+            arrays["year"], artist_values, arrays["filter_year_order"], arrays["filter_artist_rows"], arrays["filter_artist_row_offsets"],
+            arrays.get("popularity"), arrays.get("filter_popularity_order"),
+            arrays.get("filter_years_sorted"), arrays.get("filter_popularity_sorted")
+        )
+    else:
+        song_filter_index = build_song_filter_index(df)
+    
+    # Older artifacts lack the packed search texts and the id index, which
+    # are then rebuilt privately in this process
+    search_fields = None
+    if "search_name_bytes" in arrays:
+        search_fields = {field: compact.PackedStrings(arrays[f"search_{field}_bytes"], arrays[f"search_{field}_offsets"])
+                         for field in ("name", "artists")}
+    id_index = compact.build_string_index(ids)
+    if "id_hashes" in arrays:
+        id_index = {"hashes": arrays["id_hashes"], "rows": arrays["id_rows"]}
+    
+    return {
+        "df": df,
+        "df_scaled": df_scaled,
+        "scaler": scaler,
+        "kmeans": kmeans,
+        "model_version": metadata["version"],
+        "ann_index": ann_index,
+        "scaled_features": scaled_features,
+        "song_vectors": ann_index["vectors"],
+        "song_names": columns["name"],
+        "song_columns": columns,
+        "song_id_index": id_index,
+        "song_search_index": search_index.restore_search_index(
+            names, df['artists'], arrays["search_grams"], arrays["search_offsets"], arrays["search_postings"],
+            search_fields
+        ),
+        "song_filter_index": song_filter_index,
+        "model_drift": metadata.get("drift") or drift_baseline(ann_index, scaled_features, arrays["labels"]),
+        "cluster_summary": build_cluster_summary(
+            df, last_modified=time.mktime(time.strptime(metadata["created_at"], "%Y-%m-%dT%H:%M:%S"))
+        ),
+    }
+
+def drift_baseline(ann_index, scaled_features, labels):
+    """Record how well the trained clusters fit their songs, for drift_report"""
+    labels = np.asarray(labels, dtype=np.int64)
+    centroids = ann_index["centroids"]
+    distances = ((scaled_features - centroids[labels]) ** 2).sum(axis=1)
+    counts = np.bincount(labels, minlength=len(centroids)).tolist()
+    return {
+        "trained_songs": len(labels),
+        "trained_inertia": float(distances.mean()) if len(labels) else 0.0,
+        "trained_cluster_counts": counts,
+        "ingested_songs": 0,
+        "ingested_inertia": 0.0,
+        "cluster_counts": counts,
+    }
+
+def drift_report(drift):
+    """Compare ingested songs with the trained clusters and flag when to recluster"""
+    trained = np.array(drift["trained_cluster_counts"], dtype=np.float64)
+    current = np.array(drift["cluster_counts"], dtype=np.float64)
+    size_shift = 0.5 * np.abs(current / max(current.sum(), 1) - trained / max(trained.sum(), 1)).sum()
+    
+    inertia_ratio = None
+    if drift["ingested_songs"] and drift["trained_inertia"]:
+        inertia_ratio = drift["ingested_inertia"] / drift["trained_inertia"]
+    
+    return {
+        **drift,
+        "inertia_ratio": inertia_ratio,
+        "cluster_size_shift": float(size_shift),
+        "thresholds": {"inertia_ratio": DRIFT_INERTIA_RATIO, "cluster_size_shift": DRIFT_SIZE_SHIFT},
+        "recluster_recommended": bool(
+            (inertia_ratio is not None and inertia_ratio > DRIFT_INERTIA_RATIO)
+            or size_shift > DRIFT_SIZE_SHIFT
+        ),
+    }
+
+def ingest_snapshot(songs, base=None):
+    """Extend a model snapshot (by default the served model) with new songs, without retraining
+    
+    The songs are scaled with the fitted scaler and assigned to the nearest
+    existing centroid. Only the new rows are tokenized, sorted and hashed for
+    the search, filter and id indexes and the cluster statistics, but the
+    catalog columns, feature matrix and indexes are still copied to append
+    them, so an ingest takes time and memory in proportion to the catalog.
+    Songs whose id is already served are skipped, so re-sending a batch is
+    harmless, and base itself is returned if no song is new. Returns a model
+    snapshot.
+    """
+    base = base or served_snapshot()
+    df, scaler, ann_index, model_drift = base["df"], base["scaler"], base["ann_index"], base["model_drift"]
+    
+    new = pd.DataFrame(songs, columns=[column for column in catalog_columns if column in df.columns])
+    if 'popularity' in new.columns:
+        new['popularity'] = new['popularity'].fillna(0).astype(np.int64)
+    new["id"] = [song_id if isinstance(song_id, str) and song_id else hash_song_id(name, artists, year)
+                 for song_id, name, artists, year in zip(new["id"], new["name"], new["artists"], new["year"])]
+    served = [compact.string_index_lookup(base["song_id_index"], base["song_columns"]["id"], song_id) is not None
+              for song_id in new["id"]]
+    new = new[~np.array(served, dtype=bool) & ~new["id"].duplicated()].reset_index(drop=True)
+    if not len(new):
+        return base
+    new["year"] = new["year"].astype(np.int64)
+    
+    # Scalers fitted on a DataFrame expect one back; streaming ones a plain array
+    features = new[numerical_features].astype(np.float64)
+    if not hasattr(scaler, "feature_names_in_"):
+        features = features.to_numpy()
+    new_scaled = np.empty((0, len(numerical_features)), dtype=np.float32)
+    if len(new):
+        new_scaled = np.ascontiguousarray(scaler.transform(features), dtype=np.float32)
+    labels, distances = vector_index.nearest_lists(ann_index, new_scaled)
+    new["Cluster"] = labels.astype(df["Cluster"].dtype)
+    
+    new_index = vector_index.add_vectors(ann_index, vector_index.normalize_rows(new_scaled), labels)
+    # Both parts get the served artists plus the new values as categories, so
+    # concatenating keeps the served codes instead of refactorizing every row
+    artists = df['artists'].array
+    categories = artists.categories.append(pd.Index(new['artists'].unique()).difference(artists.categories))
+    added = compact_songs(new[df.columns].assign(artists=pd.Categorical(new['artists'], categories=categories)))
+    new_df = compact_songs(pd.concat([df.assign(artists=artists.set_categories(categories)), added],
+                                     ignore_index=True))
+    new_scaled_features = np.concatenate([base["scaled_features"], new_scaled])
+    
+    ingested = model_drift["ingested_songs"] + len(new)
+    drift = {
+        **model_drift,
+        "ingested_songs": ingested,
+        "ingested_inertia": float(
+            (model_drift["ingested_inertia"] * model_drift["ingested_songs"] + distances.sum()) / ingested
+        ) if ingested else 0.0,
+        "cluster_counts": (np.array(model_drift["cluster_counts"])
+                           + np.bincount(labels, minlength=len(ann_index["centroids"]))).tolist(),
+    }
+    
+    columns = build_song_columns(new_df)
+    new_id_index = compact.string_index_add(base["song_id_index"], columns["id"][len(df):])
+    popularity = added['popularity'] if 'popularity' in added.columns else None
+    statistics = merge_cluster_statistics(base["cluster_summary"]["statistics"], cluster_statistics(added))
+    
+    return {
+        "df": new_df,
+        "df_scaled": pd.DataFrame(new_scaled_features, columns=numerical_features, copy=False),
+        "scaler": scaler,
+        "kmeans": base["kmeans"],
+        "model_version": base["model_version"],
+        "ann_index": new_index,
+        "scaled_features": new_scaled_features,
+        "song_vectors": new_index["vectors"],
+        "song_names": columns["name"],
+        "song_columns": columns,
+        "song_id_index": new_id_index,
+        "song_search_index": search_index.add_rows(base["song_search_index"], new['name'], new['artists']),
+        "song_filter_index": filter_index.add_rows(base["song_filter_index"], added['year'], new['artists'], popularity),
+        "model_drift": drift,
+        "cluster_summary": build_cluster_summary(new_df, statistics),
+        # Songs other workers logged meanwhile are not in it, so the replay offset stays
+        "ingest_log_offset": base.get("ingest_log_offset", 0),
+    }
+
+def log_ingested(songs):
+    """Append songs to INGEST_LOG, one JSON object per line"""
+    lines = "".join(json.dumps(song) + "\n" for song in songs)
+    with open(INGEST_LOG, "a") as f:
+        # One locked write per request, so workers sharing the log never interleave
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(lines)
+
+def replay_ingest_log(snapshot):
+    """Return snapshot extended with the songs of INGEST_LOG, if it is set
+    
+    Songs the snapshot already serves are skipped, so replaying is harmless.
+    When snapshot is the served artifact version (e.g. a reload of an
+    unchanged model), the served model is extended with just the songs logged
+    since its last replay instead, so the reload copies no catalog when
+    nothing new was logged.
+    """
+    if not INGEST_LOG or not os.path.exists(INGEST_LOG):
+        return snapshot
+    base, offset = snapshot, 0
+    if (df is not None and snapshot["model_version"] == model_version and model_version != "live"
+            and ingest_log_offset <= os.path.getsize(INGEST_LOG)):
+        base, offset = served_snapshot(), ingest_log_offset
+    with open(INGEST_LOG, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    # A line still being appended by another worker is left for the next replay
+    data = data[:data.rfind(b"\n") + 1]
+    songs = [json.loads(line) for line in data.splitlines() if line.strip()]
+    replayed = ingest_snapshot(songs, base) if songs else base
+    if replayed is not base:
+        print(f"Replayed {len(replayed['df']) - len(base['df'])} ingested songs from {INGEST_LOG}")
+    return dict(replayed, ingest_log_offset=offset + len(data))
+
+def validate_ingest_song(song):
+    """Return an error message if song is not a valid track to ingest, else None"""
+    if not isinstance(song, dict):
+        return f"Invalid song: {song!r}"
+    for field in ("name", "artists"):
+        if not isinstance(song.get(field), str) or not song[field]:
+            return f"Song field '{field}' must be a non-empty string: {song!r}"
+    if 'id' in song and not isinstance(song['id'], str):
+        return f"Song field 'id' must be a string: {song!r}"
+    for field in ["year"] + numerical_features:
+        value = song.get(field)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not np.isfinite(value):
+            return f"Song field '{field}' must be a number: {song!r}"
+    popularity = song.get('popularity', 0)
+    if not isinstance(popularity, (int, float)) or isinstance(popularity, bool) or not np.isfinite(popularity):
+        return f"Song field 'popularity' must be a number: {song!r}"
+    return None
+
+def publish_model(root, source):
+    """Train a model and save it under root; runs in a child process of share_model
+    
+    Training errors propagate to share_model: sample data is never published
+    under the catalog's training source.
+    """
+    install_model(train_model())
+    return save_model_artifacts(root, source)
+
+def shared_version(root, source):
+    """Return the latest version under root if it was trained from source, else None"""
+    if not os.path.exists(os.path.join(root, artifacts.LATEST_FILE)):
+        return None
+    path = artifacts.resolve_artifacts(root)
+    with open(os.path.join(path, artifacts.METADATA_FILE)) as f:
+        return path if json.load(f).get("training_source") == source else None
+
+def share_model(root):
+    """Return a snapshot of the model under root trained on the current catalog
+    
+    Processes map a current model side by side under a shared lock on a file
+    in root. The first one to find none takes the lock exclusively, trains the
+    model in a child process (so no server process keeps the training heap)
+    and publishes it; the others wait for it. Older versions are then deleted;
+    processes that mapped them keep their pages until they load the new one.
+    """
+    os.makedirs(root, exist_ok=True)
+    source = training_source()
+    with open(os.path.join(root, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        path = shared_version(root, source)
+        if path is None:
+            # Not an atomic upgrade, so another process may have published meanwhile
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path = shared_version(root, source)
+        if path is None:
+            print(f"Training the shared model under {root}...")
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                path = pool.submit(publish_model, root, source).result()
+            artifacts.prune_artifacts(root, keep=path)
+        return read_model_artifacts(path)
+
+def build_model_snapshot():
+    """Build a fresh snapshot from MODEL_ARTIFACTS, the shared model, or by retraining
+    
+    Songs in INGEST_LOG are replayed onto it.
+    """
+    if MODEL_ARTIFACTS:
+        snapshot = read_model_artifacts(MODEL_ARTIFACTS)
+    elif MODEL_SHARE_DIR:
+        snapshot = share_model(MODEL_SHARE_DIR)
+    else:
+        snapshot = train_model()
+    return replay_ingest_log(snapshot)
+
+reloader = hot_reload.Reloader(build_model_snapshot, install_model)
+
+def init_model():
+    """Load the prebuilt model if MODEL_ARTIFACTS is set, the shared model if
+    MODEL_SHARE_DIR is, otherwise train one; then replay INGEST_LOG"""
+    if MODEL_ARTIFACTS:
+        load_model_artifacts(MODEL_ARTIFACTS)
+    elif MODEL_SHARE_DIR:
+        install_model(share_model(MODEL_SHARE_DIR))
+        print(f"Model {model_version} shared from {MODEL_SHARE_DIR}! {len(df)} songs.")
+    else:
+        load_and_process_data()
+    if INGEST_LOG:
+        install_model(replay_ingest_log(served_snapshot()))
+    
+    if RELOAD_WATCH_INTERVAL > 0 and (MODEL_ARTIFACTS or MODEL_SHARE_DIR):
+        root = MODEL_ARTIFACTS or MODEL_SHARE_DIR
+        hot_reload.watch(
+            lambda: artifacts.resolve_artifacts(root),
+            reloader.start, RELOAD_WATCH_INTERVAL
+        )
+
+def create_app():
+    """WSGI entry point, e.g. gunicorn --preload 'app:create_app()'"""
+    init_model()
+    return app
+
+def find_song_by_id(song_id):
+    """Return the row of the song with id song_id, or None"""
+    return compact.string_index_lookup(song_id_index, song_columns['id'], song_id)
+
+def find_song(song_name):
+    """Return the row of the first song whose name contains song_name, or None"""
+    rows = search_index.search(song_search_index, song_name, limit=1, fields=("name",))
+    return rows[0] if rows else None
+
+def recommend_songs(song_name, num_recommendations=5, probes=None, exact=None,
+                    diversity=0.0, max_per_artist=None, filters=None):
+    """Recommend songs based on clustering and similarity
+    
+    diversity (0 to 1) trades similarity for variety by MMR re-ranking, and
+    max_per_artist caps the results by any one artist. filters holds keyword
+    arguments of filter_index.filter_rows, e.g. {"year_min": 1970, "year_max": 1979}.
+    """
     try:
-        # Find songs with partial matching
-        matching_songs = df[df['name'].str.contains(song_name, case=False, na=False)]
+        # Use the first song with partial matching
+        song_row = find_song(song_name)
         
-        if matching_songs.empty:
+        if song_row is None:
             return None
         
-        # Use the first match
-        song_data = matching_songs.iloc[0]
-        song_cluster = song_data['Cluster']
+        return recommend_for_row(song_row, num_recommendations, probes, exact, diversity, max_per_artist,
+                                 filters)
         
-        # Get all songs in the same cluster
-        same_cluster_songs = df[df['Cluster'] == song_cluster].copy()
-        
-        if len(same_cluster_songs) <= 1:
-            return pd.DataFrame()
-        
-        # Calculate cosine similarity
-        song_features = df_scaled.loc[song_data.name:song_data.name, numerical_features]
-        cluster_indices = same_cluster_songs.index
-        cluster_features = df_scaled.loc[cluster_indices, numerical_features]
-        
-        # Compute similarities
-        similarities = cosine_similarity(song_features, cluster_features)[0]
-        
-        # Create similarity dataframe
-        same_cluster_songs = same_cluster_songs.copy()
-        same_cluster_songs['similarity'] = similarities
+    except Exception as e:
+        print(f"Error in recommend_songs: {e}")
+        recommend_errors.inc()
+        return pd.DataFrame()
+
+def recommend_for_row(song_row, num_recommendations=5, probes=None, exact=None,
+                      diversity=0.0, max_per_artist=None, filters=None):
+    """Recommend songs similar to the song at row song_row, as a DataFrame"""
+    return pd.DataFrame(recommend_columns(song_row, num_recommendations, probes, exact,
+                                          diversity, max_per_artist, filters))
+
+def recommend_columns(song_row, num_recommendations=5, probes=None, exact=None,
+                      diversity=0.0, max_per_artist=None, filters=None):
+    """Recommend songs similar to the song at row song_row, as {column: list}"""
+    try:
+        if probes is None:
+            probes = ANN_PROBES
+        if exact is None:
+            exact = ANN_MODE == "exact"
         
-        # Remove the input song and sort by similarity
-        recommendations = same_cluster_songs[
-            same_cluster_songs['name'] != song_data['name']
-        ].sort_values('similarity', ascending=False).head(num_recommendations)
+        # Over-fetch a little so dropping other versions of the input song
+        # (same name, different row) still leaves enough results, and a whole
+        # pool when re-ranking
+        candidates = num_recommendations + 10
+        if diversity or max_per_artist:
+            candidates = max(candidates, DIVERSITY_POOL)
+        allowed, exclude = None, [song_row]
+        if filters:
+            with recommend_stage_latency.time(stage="filter"):
+                allowed, excluded = filter_index.filter_rows(song_filter_index, **filters)
+            if excluded is not None:
+                exclude = np.append(excluded, song_row)
+        timings = {}
+        rows, similarities = vector_index.search(
+            ann_index, scaled_features[song_row], candidates,
+            probes=probes, exact=exact, exclude=exclude, ratio=ANN_PROBE_RATIO,
+            timings=timings, allowed=allowed, rerank=ANN_RERANK
+        )
+        for stage, seconds in timings.items():
+            recommend_stage_latency.observe(seconds, stage=stage)
         
-        return recommendations[['name', 'year', 'artists', 'similarity', 'Cluster']]
+        with recommend_stage_latency.time(stage="results"):
+            return recommendation_columns(song_row, rows, similarities, num_recommendations,
+                                          diversity, max_per_artist)
         
     except Exception as e:
-        print(f"Error in recommend_songs: {e}")
-        return pd.DataFrame()
+        print(f"Error in recommend_columns: {e}")
+        recommend_errors.inc()
+        return {}
+
+def recommendation_columns(song_row, rows, similarities, num_recommendations,
+                           diversity=0.0, max_per_artist=None):
+    """Gather the response columns of the search results of song_row, re-ranked if asked"""
+    # Remove other versions of the input song
+    keep = ~song_names.equal_at(rows, song_names[song_row])
+    rows, similarities = rows[keep], similarities[keep]
+    if diversity or max_per_artist:
+        rows, similarities = diversify(rows, similarities, num_recommendations, diversity, max_per_artist)
+    return result_columns(rows[:num_recommendations], similarities[:num_recommendations])
+
+def diversify(rows, similarities, num_recommendations, diversity=0.0, max_per_artist=None):
+    """Re-rank candidate rows by MMR with an optional per-artist cap; returns the picked rows
+    
+    The cap applies to each individual artist: a song credited to A and B
+    counts towards both A's and B's picks.
+    """
+    artists = None
+    if max_per_artist:
+        codes, values = pd.factorize(song_columns['artists'][rows])
+        names = {}
+        credits = [[names.setdefault(name, len(names)) for name in filter_index.artist_names(value)]
+                   for value in values]
+        artists = np.zeros((len(credits), len(names)), dtype=bool)
+        for code, credited in enumerate(credits):
+            artists[code, credited] = True
+        artists = artists[codes]
+    picks = vector_index.mmr(song_vectors[rows], similarities, num_recommendations,
+                             diversity, artists, max_per_artist)
+    return rows[picks], similarities[picks]
+
+def result_columns(rows, similarities):
+    """Gather the recommendation response columns of rows"""
+    columns = serialization.gather(song_columns, rows, ('id', 'name', 'year', 'artists'),
+                                   extra={'similarity': similarities})
+    columns['Cluster'] = song_columns['Cluster'][rows].tolist()
+    return columns
+
+def recommend_batch(requests, probes=None, exact=None, diversity=0.0, max_per_artist=None):
+    """Recommend songs for many (song row, k) pairs in one vectorized pass.
+    
+    Returns one {column: list} of recommendations per request, or None for
+    requests whose song row is None.
+    """
+    if probes is None:
+        probes = ANN_PROBES
+    if exact is None:
+        exact = ANN_MODE == "exact"
+    
+    found = [i for i, (song_row, _) in enumerate(requests) if song_row is not None]
+    results = [None] * len(requests)
+    if not found:
+        return results
+    
+    query_rows = np.array([requests[i][0] for i in found])
+    candidates = max(requests[i][1] for i in found) + 10
+    if diversity or max_per_artist:
+        candidates = max(candidates, DIVERSITY_POOL)
+    matches = vector_index.search_batch(
+        ann_index, scaled_features[query_rows], candidates,
+        probes=probes, exact=exact, exclude=query_rows, ratio=ANN_PROBE_RATIO, rerank=ANN_RERANK
+    )
+    
+    for i, song_row, (rows, similarities) in zip(found, query_rows, matches):
+        results[i] = recommendation_columns(song_row, rows, similarities, requests[i][1],
+                                            diversity, max_per_artist)
+    return results
+
+def recommend_playlist(seed_rows, weights, num_recommendations=10, probes=None, exact=None,
+                       diversity=0.0, max_per_artist=None):
+    """Recommend songs like a whole playlist, as {column: list}
+    
+    The query is the weighted mean of the seeds' scaled features, searched
+    once; the seeds themselves are never returned.
+    """
+    if probes is None:
+        probes = ANN_PROBES
+    if exact is None:
+        exact = ANN_MODE == "exact"
+    
+    seed_rows = np.asarray(seed_rows, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float32)
+    query = weights @ scaled_features[seed_rows] / weights.sum()
+    diversifying = bool(diversity or max_per_artist)
+    rows, similarities = vector_index.search(
+        ann_index, query, max(num_recommendations, DIVERSITY_POOL) if diversifying else num_recommendations,
+        probes=probes, exact=exact, exclude=seed_rows, ratio=ANN_PROBE_RATIO, rerank=ANN_RERANK
+    )
+    if diversifying:
+        rows, similarities = diversify(rows, similarities, num_recommendations, diversity, max_per_artist)
+    return result_columns(rows, similarities)
 
 # HTML Template
 HTML_TEMPLATE = """
@@ -623,89 +1633,533 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Compiled once; render_template_string would re-parse the source on every call
+index_template = app.jinja_env.from_string(HTML_TEMPLATE)
+
+@app.before_request
+def start_request():
+    """Start timing (and, when enabled, profiling) this request"""
+    g.request_started = time.perf_counter()
+    request_profiler.begin()
+
+@app.after_request
+def record_request(response):
+    """Record the request latency under its route pattern"""
+    duration = time.perf_counter() - g.pop('request_started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_latency.observe(duration, method=request.method, route=route, status=response.status_code)
+    profile = request_profiler.end(f"{request.method} {request.path}", duration)
+    if profile:
+        print(f"Slow request {request.method} {request.full_path} took {duration * 1000:.0f} ms, profile written to {profile}")
+    return response
+
+@app.before_request
+def hold_model():
+    """Keep the current model installed until this request finishes"""
+    model_lock.acquire_read()
+    g.holds_model = True
+
+@app.teardown_request
+def release_model(exc=None):
+    if g.pop('holds_model', False):
+        model_lock.release_read()
+
+def summary_page(name, mimetype):
+    """Serve a page of cluster_summary, or 304 when the client's copy is current"""
+    response = Response(cluster_summary["pages"][name], mimetype=mimetype)
+    response.set_etag(cluster_summary["etags"][name])
+    response.last_modified = cluster_summary["last_modified"]
+    # Cacheable, but revalidated on every load so a new model shows up at once
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
     """Main page"""
-    cluster_counts = df['Cluster'].value_counts().sort_index()
-    cluster_data = [{"cluster": int(cluster), "count": int(count)} for cluster, count in cluster_counts.items()]
-    
-    return render_template_string(HTML_TEMPLATE, 
-                                total_songs=len(df),
-                                total_clusters=len(cluster_counts),
-                                cluster_data=json.dumps(cluster_data))
+    return summary_page("index", "text/html")
 
 @app.route('/api/search')
 def search_songs():
-    """Search for songs"""
+    """Search for songs; ?format=columnar returns {column: list} instead of records"""
     query = request.args.get('q', '')
     if not query:
         return jsonify([])
+    columnar = request.args.get('format') == 'columnar'
     
-    # Search in both name and artist fields
-    mask = (df['name'].str.contains(query, case=False, na=False) | 
-            df['artists'].str.contains(query, case=False, na=False))
+    # Matching is case-insensitive, so the lowercased query is the cache key
+    key = (query.lower(), columnar)
+    body = search_cache.get(key)
+    if body is None:
+        # Search in both name and artist fields
+        rows = search_index.search(song_search_index, query, limit=10)
+        results = serialization.gather(song_columns, np.asarray(rows, dtype=np.int64),
+                                       ('id', 'name', 'artists', 'year'))
+        body = serialization.dumps(results if columnar else serialization.records(results))
+        search_cache.put(key, body)
     
-    results = df[mask][['name', 'artists', 'year']].head(10)
-    return jsonify(results.to_dict('records'))
+    return serialization.json_response(body)
 
 @app.route('/api/recommend')
 def get_recommendations():
-    """Get song recommendations"""
+    """Get song recommendations for a song id (?id=) or name (?song=)
+    
+    ?k= sets the number of results and ?probes= the number of nearest
+    clusters searched (default ANN_PROBES); ?format=columnar returns the
+    recommendations as {column: list} instead of records. ?diversity= (0 to 1)
+    re-ranks for variety and ?max_per_artist= caps songs per artist.
+    ?year_min=, ?year_max=, ?min_popularity=, ?artist= and ?exclude_artist=
+    (both repeatable) filter the recommendations.
+    """
+    song_id = request.args.get('id', '')
     song_name = request.args.get('song', '')
-    if not song_name:
-        return jsonify({"error": "Song name is required"})
+    if not song_id and not song_name:
+        return jsonify({"error": "Song id or name is required"})
     
-    recommendations = recommend_songs(song_name)
+    num_recommendations = request.args.get('k', 5, type=int)
+    if num_recommendations < 1:
+        return jsonify({"error": "k must be a positive integer"})
+    if num_recommendations > MAX_RECOMMENDATIONS:
+        return jsonify({"error": f"k must be at most {MAX_RECOMMENDATIONS}"})
+    probes = request.args.get('probes', ANN_PROBES, type=int)
+    if probes < 1:
+        return jsonify({"error": "probes must be a positive integer"})
+    columnar = request.args.get('format') == 'columnar'
+    diversity = request.args.get('diversity', 0.0, type=float)
+    max_per_artist = request.args.get('max_per_artist', 0, type=int)
+    error = invalid_diversity(diversity, max_per_artist)
+    if error:
+        return jsonify({"error": error})
+    filters, error = recommendation_filters(request.args)
+    if error:
+        return jsonify({"error": error})
     
-    if recommendations is None:
-        return jsonify({"error": f"Song '{song_name}' not found in database"})
+    key = ('id', song_id) if song_id else ('song', song_name.lower())
+    key += (num_recommendations, probes, columnar, diversity, max_per_artist)
+    key += tuple((name, tuple(value) if isinstance(value, list) else value)
+                 for name, value in sorted(filters.items()))
+    body = recommend_cache.get(key)
+    if body is None:
+        response = recommendation_response(song_id, song_name, num_recommendations, probes, columnar,
+                                           diversity, max_per_artist, filters)
+        with recommend_stage_latency.time(stage="serialization"):
+            body = serialization.dumps(response)
+        recommend_cache.put(key, body)
     
-    if recommendations.empty:
-        return jsonify({"error": "No similar songs found in the same cluster"})
+    return serialization.json_response(body)
+
+def invalid_diversity(diversity, max_per_artist):
+    """Return an error message for invalid re-ranking options, else None"""
+    if not isinstance(diversity, (int, float)) or isinstance(diversity, bool) or not 0 <= diversity <= 1:
+        return "diversity must be a number between 0 and 1"
+    if not isinstance(max_per_artist, int) or isinstance(max_per_artist, bool) or max_per_artist < 0:
+        return "max_per_artist must be a non-negative integer"
+    return None
+
+def recommendation_filters(args):
+    """Parse the recommendation filters in query args; returns (filters, error)"""
+    filters = {}
+    for name, convert in (('year_min', int), ('year_max', int), ('min_popularity', float)):
+        value = args.get(name, '')
+        if value:
+            try:
+                filters[name] = convert(value)
+            except ValueError:
+                return None, f"{name} must be a number"
+    if 'min_popularity' in filters and song_filter_index["popularity_order"] is None:
+        return None, "Popularity is not available for this catalog"
+    for name, arg in (('artists', 'artist'), ('exclude_artists', 'exclude_artist')):
+        values = [value for value in args.getlist(arg) if value]
+        if values:
+            filters[name] = values
+    return filters, None
+
+def recommendation_response(song_id, song_name, num_recommendations, probes=None, columnar=False,
+                            diversity=0.0, max_per_artist=None, filters=None):
+    """Build the /api/recommend response body, resolving song_id before song_name"""
+    with recommend_stage_latency.time(stage="lookup"):
+        song_row = find_song_by_id(song_id) if song_id else find_song(song_name)
+    if song_row is None:
+        if song_id:
+            return {"error": f"Song id '{song_id}' not found in database"}
+        return {"error": f"Song '{song_name}' not found in database"}
     
-    # Get the input song's cluster for chart highlighting
-    matching_songs = df[df['name'].str.contains(song_name, case=False, na=False)]
-    input_cluster = matching_songs.iloc[0]['Cluster'] if not matching_songs.empty else None
+    recommendations = recommend_columns(song_row, num_recommendations, probes,
+                                        diversity=diversity, max_per_artist=max_per_artist, filters=filters)
     
+    if not recommendations.get('id'):
+        if filters:
+            active = ", ".join(f"{name}={','.join(value) if isinstance(value, list) else value}"
+                               for name, value in sorted(filters.items()))
+            return {"error": f"No similar songs found matching the filters ({active})"}
+        return {"error": "No similar songs found"}
+    
+    return {
+        "recommendations": recommendations if columnar else serialization.records(recommendations),
+        # The input song's cluster, for chart highlighting
+        "input_cluster": int(song_columns['Cluster'][song_row])
+    }
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Get hit/miss/eviction counters of the response caches"""
     return jsonify({
-        "recommendations": recommendations.to_dict('records'),
-        "input_cluster": int(input_cluster) if input_cluster is not None else None
+        "recommend": recommend_cache.stats(),
+        "search": search_cache.stats()
     })
 
-@app.route('/api/cluster-stats')
-def cluster_stats():
-    """Get cluster statistics"""
-    cluster_counts = df['Cluster'].value_counts().sort_index()
-    cluster_data = [{"cluster": int(cluster), "count": int(count)} for cluster, count in cluster_counts.items()]
+@app.route('/api/recommend/batch', methods=['POST'])
+def get_batch_recommendations():
+    """Get recommendations for a list of songs in one request
     
-    return jsonify({
-        "total_songs": len(df),
-        "total_clusters": len(cluster_counts),
-        "cluster_distribution": cluster_data
+    Body: {"songs": ["Hey Jude", {"song": "Imagine", "k": 10}, {"id": "..."}], "k": 5}
+    An optional "probes" sets the number of nearest clusters searched, and
+    "format": "columnar" returns each song's recommendations as {column: list}.
+    "diversity" and "max_per_artist" work as for /api/recommend.
+    """
+    payload = request.get_json(silent=True) or {}
+    songs = payload.get('songs')
+    if not isinstance(songs, list) or not songs:
+        return jsonify({"error": "A non-empty 'songs' list is required"})
+    if len(songs) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} songs per batch"})
+    
+    probes = payload.get('probes', ANN_PROBES)
+    if not isinstance(probes, int) or isinstance(probes, bool) or probes < 1:
+        return jsonify({"error": "probes must be a positive integer"})
+    
+    diversity = payload.get('diversity', 0.0)
+    max_per_artist = payload.get('max_per_artist', 0)
+    error = invalid_diversity(diversity, max_per_artist)
+    if error:
+        return jsonify({"error": error})
+    
+    columnar = payload.get('format') == 'columnar'
+    default_k = payload.get('k', 5)
+    items = []
+    batch = []
+    for item in songs:
+        if isinstance(item, dict):
+            field = 'id' if 'id' in item else 'song'
+            value, k = item.get(field, ''), item.get('k', default_k)
+        else:
+            field, value, k = 'song', item, default_k
+        if not isinstance(value, str) or not value or not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            return jsonify({"error": f"Invalid batch item: {item!r}"})
+        if k > MAX_RECOMMENDATIONS:
+            return jsonify({"error": f"k must be at most {MAX_RECOMMENDATIONS}: {item!r}"})
+        song_row = find_song_by_id(value) if field == 'id' else find_song(value)
+        items.append((field, value))
+        batch.append((song_row, k))
+    
+    matches = recommend_batch(batch, probes, diversity=diversity, max_per_artist=max_per_artist)
+    results = []
+    for (field, value), (song_row, _), recommendations in zip(items, batch, matches):
+        if song_row is None:
+            label = "Song id" if field == 'id' else "Song"
+            results.append({field: value, "error": f"{label} '{value}' not found in database"})
+        else:
+            results.append({
+                field: value,
+                "input_cluster": int(song_columns['Cluster'][song_row]),
+                "recommendations": recommendations if columnar else serialization.records(recommendations)
+            })
+    
+    return serialization.json_response({"results": results})
+
+@app.route('/api/recommend/playlist', methods=['POST'])
+def get_playlist_recommendations():
+    """Get recommendations for a playlist of seed songs
+    
+    Body: {"seeds": ["<id>", {"id": "<id>", "weight": 2.0}], "k": 10}
+    Seeds default to weight 1. "probes", "format", "diversity" and
+    "max_per_artist" work as for /api/recommend.
+    """
+    payload = request.get_json(silent=True) or {}
+    seeds = payload.get('seeds')
+    if not isinstance(seeds, list) or not seeds:
+        return jsonify({"error": "A non-empty 'seeds' list is required"})
+    if len(seeds) > MAX_PLAYLIST_SEEDS:
+        return jsonify({"error": f"At most {MAX_PLAYLIST_SEEDS} seeds per playlist"})
+    
+    k = payload.get('k', 10)
+    probes = payload.get('probes', ANN_PROBES)
+    for name, value in (('k', k), ('probes', probes)):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            return jsonify({"error": f"{name} must be a positive integer"})
+    if k > MAX_RECOMMENDATIONS:
+        return jsonify({"error": f"k must be at most {MAX_RECOMMENDATIONS}"})
+    diversity = payload.get('diversity', 0.0)
+    max_per_artist = payload.get('max_per_artist', 0)
+    error = invalid_diversity(diversity, max_per_artist)
+    if error:
+        return jsonify({"error": error})
+    
+    seed_rows = []
+    weights = []
+    missing = []
+    for seed in seeds:
+        song_id, weight = (seed.get('id'), seed.get('weight', 1)) if isinstance(seed, dict) else (seed, 1)
+        if (not isinstance(song_id, str) or not isinstance(weight, (int, float)) or isinstance(weight, bool)
+                or not np.isfinite(weight) or weight <= 0):
+            return jsonify({"error": f"Invalid seed: {seed!r}"})
+        song_row = find_song_by_id(song_id)
+        if song_row is None:
+            missing.append(song_id)
+        else:
+            seed_rows.append(song_row)
+            weights.append(weight)
+    if not seed_rows:
+        return jsonify({"error": "None of the seed songs were found in database", "missing": missing})
+    
+    recommendations = recommend_playlist(seed_rows, weights, k, probes,
+                                         diversity=diversity, max_per_artist=max_per_artist)
+    return serialization.json_response({
+        "recommendations": recommendations if payload.get('format') == 'columnar'
+                           else serialization.records(recommendations),
+        "seeds": len(seed_rows),
+        "missing": missing
     })
 
-@app.route('/api/song-details/<int:song_id>')
+def is_admin():
+    """Return True if the request carries the admin token"""
+    return bool(ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+@app.route('/api/admin/reload', methods=['GET', 'POST'])
+def reload_model():
+    """Start a background model reload (POST) or report its status (GET)"""
+    if not is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    if request.method == 'POST' and not reloader.start():
+        return jsonify({"error": "A reload is already running", **reloader.status()}), 409
+    
+    return jsonify({"model_version": model_version, **reloader.status()})
+
+def ingest_and_log(songs):
+    """Build the snapshot with songs ingested, recording them in INGEST_LOG first if set"""
+    snapshot = ingest_snapshot(songs)
+    # Logged before installing, so a reload can never start between the two and miss them
+    if INGEST_LOG:
+        log_ingested(songs)
+    return snapshot
+
+@app.route('/api/admin/ingest', methods=['GET', 'POST'])
+def ingest_songs():
+    """Add new songs to the served model (POST) or report cluster drift (GET)
+    
+    Body: {"songs": [{"name": ..., "artists": ..., "year": ..., "valence": ..., ...}]}
+    Each song needs every audio feature; "id" is optional and hashed when absent.
+    """
+    if not is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        songs = payload.get('songs')
+        if not isinstance(songs, list) or not songs:
+            return jsonify({"error": "A non-empty 'songs' list is required"})
+        if len(songs) > MAX_INGEST_SIZE:
+            return jsonify({"error": f"At most {MAX_INGEST_SIZE} songs per request"})
+        for song in songs:
+            error = validate_ingest_song(song)
+            if error:
+                return jsonify({"error": error})
+        
+        # Installing waits for every request to release the model, this one included
+        release_model()
+        before = len(df)
+        snapshot = reloader.apply(lambda: ingest_and_log(songs))
+        if snapshot is None:
+            return jsonify({"error": "A reload or ingest is already running", **reloader.status()}), 409
+        
+        ingested = snapshot["df"]["id"].iloc[before:].tolist()
+        report = drift_report(snapshot["model_drift"])
+        if report["recluster_recommended"]:
+            print(f"Cluster drift after ingest: inertia ratio {report['inertia_ratio']}, "
+                  f"size shift {report['cluster_size_shift']:.3f}; consider reclustering")
+        return jsonify({
+            "ingested": ingested,
+            "skipped": len(songs) - len(ingested),
+            "total_songs": len(snapshot["df"]),
+            "drift": report
+        })
+    
+    return jsonify({"total_songs": len(df), "drift": drift_report(model_drift)})
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST'])
+def toggle_profiler():
+    """Enable or disable the slow-request profiler (POST) or report its status (GET)
+    
+    Body: {"enabled": true, "threshold_ms": 250}
+    """
+    if not is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        threshold_ms = payload.get('threshold_ms')
+        if threshold_ms is not None and (not isinstance(threshold_ms, (int, float)) or threshold_ms < 0):
+            return jsonify({"error": "threshold_ms must be a non-negative number"})
+        if payload.get('enabled', True):
+            request_profiler.enable(None if threshold_ms is None else threshold_ms / 1000)
+        else:
+            request_profiler.disable()
+    
+    return jsonify(request_profiler.status())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose request, recommendation, cache and model metrics in Prometheus text format"""
+    caches = {"recommend": recommend_cache.stats(), "search": search_cache.stats()}
+    
+    def per_cache(field):
+        return [((name,), stats[field]) for name, stats in caches.items()]
+    
+    list_sizes = np.diff(ann_index["offsets"])
+    drift = drift_report(model_drift)
+    body = metrics.render(
+        request_latency.render(),
+        recommend_stage_latency.render(),
+        recommend_errors.render(),
+        metrics.collect("cache_hits_total", "Response cache hits", per_cache("hits"), ("cache",), "counter"),
+        metrics.collect("cache_misses_total", "Response cache misses", per_cache("misses"), ("cache",), "counter"),
+        metrics.collect("cache_evictions_total", "Response cache LRU evictions", per_cache("evictions"), ("cache",), "counter"),
+        metrics.collect("cache_expirations_total", "Response cache TTL expirations", per_cache("expirations"), ("cache",), "counter"),
+        metrics.collect("cache_entries", "Entries in the response cache", per_cache("size"), ("cache",)),
+        metrics.collect("model_info", "Served model version", [((model_version,), 1)], ("version",)),
+        metrics.collect("catalog_songs", "Songs in the served catalog", len(df)),
+        metrics.collect("model_reloads_total", "Completed background model reloads", reloader.reloads, kind="counter"),
+        metrics.collect("model_ingested_songs", "Songs ingested since the model was trained", model_drift["ingested_songs"]),
+        metrics.collect("model_cluster_size_shift", "Total variation distance of cluster sizes since training",
+                        drift["cluster_size_shift"]),
+        metrics.collect("ann_index_lists", "Lists (clusters) in the nearest-neighbour index", len(list_sizes)),
+        metrics.collect("ann_index_list_songs", "Songs per nearest-neighbour list",
+                        [((str(i),), int(size)) for i, size in enumerate(list_sizes)], ("list",)),
+        metrics.collect("search_index_grams", "Distinct trigrams in the search index", len(song_search_index["grams"])),
+        metrics.collect("search_index_postings", "Postings in the search index", len(song_search_index["postings"])),
+        metrics.collect("profiles_written_total", "Slow-request profiles written", request_profiler.profiles_written,
+                        kind="counter"),
+    )
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/cluster-stats')
+def cluster_stats():
+    """Get cluster statistics: song counts, mean audio features and year range per cluster"""
+    return summary_page("cluster_stats", "application/json")
+
+@app.route('/api/song-details/<song_id>')
 def song_details(song_id):
     """Get detailed information about a specific song"""
-    if song_id >= len(df):
+    song_row = find_song_by_id(song_id)
+    if song_row is None:
         return jsonify({"error": "Song not found"})
     
-    song = df.iloc[song_id]
+    song = df.iloc[song_row]
     return jsonify({
+        "id": song['id'],
         "name": song['name'],
         "artists": song['artists'],
-        "year": song['year'],
+        "year": int(song['year']),
         "cluster": int(song['Cluster']),
-        "features": {feature: float(song[feature]) for feature in numerical_features}
+        # Features are float32; str() gives their shortest round-tripping form
+        "features": {feature: float(str(song[feature])) for feature in numerical_features}
     })
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Music Recommendation System")
+    subcommands = parser.add_subparsers(dest="command")
+    sweep = argparse.ArgumentParser(add_help=False)
+    sweep.add_argument("--ks", default="2-12", help="cluster counts to sweep, e.g. 2-12 or 4,5,8")
+    sweep.add_argument("--seeds", default="42,43,44", help="comma-separated KMeans seeds per k")
+    sweep.add_argument("--sample", type=int, default=None,
+                       help="songs sampled for the sweep (default: the rows training uses, 0 = all)")
+    sweep.add_argument("--silhouette-sample", type=int, default=10_000, help="songs scored per silhouette")
+    sweep.add_argument("--criterion", choices=selection.CRITERIA, default="elbow", help="how k is chosen")
+    sweep.add_argument("--workers", type=int, default=None, help="sweep processes (default: all cores)")
+    build = subcommands.add_parser("build", parents=[sweep], help="train the model and write it as artifacts")
+    build.add_argument("--clusters", type=int, default=N_CLUSTERS, help="number of song clusters")
+    build.add_argument("--select-k", action="store_true", help="choose the number of clusters with a k sweep first")
+    build.add_argument("--output", default="artifacts", help="artifact root directory")
+    build.add_argument("--full", action="store_true", help="train on the full catalog with streaming passes")
+    build.add_argument("--chunksize", type=int, default=TRAIN_CHUNKSIZE, help="rows per streaming training chunk")
+    build.add_argument("--epochs", type=int, default=TRAIN_EPOCHS, help="streaming passes over the catalog for clustering")
+    recall = subcommands.add_parser("recall", help="measure recommendation recall against exact search")
+    recall.add_argument("--probes", default="1,2,3,5", help="comma-separated probe counts to compare")
+    recall.add_argument("--ratio", type=float, default=ANN_PROBE_RATIO, help="probe distance ratio (0 disables)")
+    recall.add_argument("--queries", type=int, default=500, help="number of sampled query songs")
+    recall.add_argument("-k", type=int, default=10, help="recommendations per query")
+    recall.add_argument("--quantize", action="store_true", help="also measure the int8-quantized index")
+    recall.add_argument("--rerank", type=int, default=ANN_RERANK, help="candidates re-ranked per result when quantized")
+    subcommands.add_parser("select-k", parents=[sweep], help="sweep cluster counts and report the best")
+    convert = subcommands.add_parser("convert", help="convert the CSV dataset into a columnar catalog")
+    convert.add_argument("csv", nargs="?", default="data.csv.zip", help="CSV file to convert")
+    convert.add_argument("--output", default=CATALOG_PATH, help="catalog directory")
+    convert.add_argument("--chunksize", type=int, default=100_000, help="rows parsed per chunk")
+    args = parser.parse_args()
+    
+    if args.command == "convert":
+        rows = catalog.convert_csv(args.csv, args.output, catalog_columns,
+                                   string_columns=string_columns, chunksize=args.chunksize)
+        print(f"Catalog with {rows} songs written to {args.output}")
+        raise SystemExit(0)
+    
+    def sweep_args():
+        if "-" in args.ks:
+            low, high = (int(k) for k in args.ks.split("-"))
+            ks = range(low, high + 1)
+        else:
+            ks = [int(k) for k in args.ks.split(",")]
+        return dict(ks=ks, seeds=[int(seed) for seed in args.seeds.split(",")], sample_size=args.sample,
+                    silhouette_sample=args.silhouette_sample, criterion=args.criterion, workers=args.workers)
+    
+    if args.command == "select-k":
+        result = sweep_clusters(**sweep_args())
+        print(f"{'k':>3} {'inertia':>10} {'silhouette':>10}")
+        for fit in result["diagnostics"]:
+            marker = "  <- chosen" if fit["k"] == result["k"] else ""
+            print(f"{fit['k']:>3} {fit['inertia']:>10.4f} {fit['silhouette']:>10.4f}{marker}")
+        raise SystemExit(0)
+    
+    if args.command == "recall":
+        init_model()
+        query_rows = np.random.RandomState(42).choice(len(df), min(args.queries, len(df)), replace=False)
+        queries = [(row, scaled_features[row]) for row in query_rows]
+        float_index = vector_index.unquantize_index(ann_index)
+        indexes = [("float32", float_index)]
+        if args.quantize:
+            indexes.append((f"int8 x{args.rerank}", vector_index.quantize_index(float_index)))
+        for name, ann in indexes:
+            print(f"{name}: lists take {vector_index.list_nbytes(ann) / 2**20:.1f} MiB")
+        for probes in (int(p) for p in args.probes.split(",")):
+            scanned = vector_index.scan_fraction(float_index, scaled_features[query_rows], probes, args.ratio)
+            for name, ann in indexes:
+                recall_value = vector_index.recall_at_k(ann, queries, args.k, probes=probes, ratio=args.ratio,
+                                                        rerank=args.rerank)
+                print(f"probes={probes:<3} {name:<8} recall@{args.k}={recall_value:.4f}  "
+                      f"scanned {scanned:6.1%} of {len(df)} songs")
+        raise SystemExit(0)
+    
+    if args.command == "build":
+        if args.full:
+            SAMPLE_SIZE = 0
+        TRAIN_CHUNKSIZE = args.chunksize
+        TRAIN_EPOCHS = args.epochs
+        N_CLUSTERS = args.clusters
+        if args.select_k:
+            model_selection = sweep_clusters(**sweep_args())
+            N_CLUSTERS = model_selection["k"]
+        # No sample-data fallback: a failed build must not publish a demo model
+        install_model(replay_ingest_log(train_model()))
+        print(f"Trained on {len(df)} songs.")
+        print(f"Artifacts written to {save_model_artifacts(args.output)}")
+        raise SystemExit(0)
+    
     print("Starting Music Recommendation System...")
     print("Loading and processing data...")
     
-    load_and_process_data()
+    init_model()
     
     print("\nStarting Flask server...")
     print("Access the application at: http://localhost:5000")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""Versioned on-disk model artifacts.
+
+A build writes every array of the model as an uncompressed .npy file plus a
+metadata.json into <root>/<version>/, then points <root>/LATEST at it. Loading
+memory-maps the arrays read-only, so startup cost does not grow with the
+catalog and every worker process on a box shares the same page cache.
+"""
+import itertools
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 2
+METADATA_FILE = "metadata.json"
+LATEST_FILE = "LATEST"
+
+
+def encode_strings(values):
+    """Pack strings into one UTF-8 byte buffer plus an offsets array"""
+    encoded = [(value if isinstance(value, str) else "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(buffer, offsets):
+    """Unpack strings packed by encode_strings"""
+    data = bytes(buffer)
+    offsets = offsets.tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def save_artifacts(root, arrays, metadata):
+    """Write arrays and metadata as a new version under root and mark it latest.
+
+    The version is staged in a temporary directory and renamed into place, so a
+    reader never sees a partially written version. Returns the version path.
+    """
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    os.makedirs(root, exist_ok=True)
+    # Private to this process, as other builds may be staging into root too
+    staging = os.path.join(root, f".{stamp}-{os.getpid()}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(array))
+
+    metadata = dict(metadata, format_version=FORMAT_VERSION,
+                    created_at=time.strftime("%Y-%m-%dT%H:%M:%S"), arrays=sorted(arrays))
+    # A build finishing in the same second takes the next suffix (-2, -3, ...)
+    for attempt in itertools.count(1):
+        version = stamp if attempt == 1 else f"{stamp}-{attempt}"
+        with open(os.path.join(staging, METADATA_FILE), "w") as f:
+            json.dump(dict(metadata, version=version), f, indent=2)
+        path = os.path.join(root, version)
+        try:
+            os.rename(staging, path)
+            break
+        except OSError:
+            if not os.path.exists(path):
+                raise
+
+    latest = os.path.join(root, f".{LATEST_FILE}-{os.getpid()}.tmp")
+    with open(latest, "w") as f:
+        f.write(version)
+    os.replace(latest, os.path.join(root, LATEST_FILE))
+    return path
+
+
+def prune_artifacts(root, keep):
+    """Delete every version under root except the version directory keep.
+
+    Processes that have already memory-mapped a deleted version keep reading
+    it until they unmap it.
+    """
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not name.startswith(".") and os.path.isdir(path) and not os.path.samefile(path, keep):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def resolve_artifacts(path):
+    """Return the version directory for path, following root/LATEST if needed"""
+    if os.path.exists(os.path.join(path, METADATA_FILE)):
+        return path
+    with open(os.path.join(path, LATEST_FILE)) as f:
+        return os.path.join(path, f.read().strip())
+
+
+def load_artifacts(path, mmap=True):
+    """Load (arrays, metadata) from a version directory or artifact root"""
+    path = resolve_artifacts(path)
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+    if metadata.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {metadata.get('format_version')} in {path}")
+
+    mode = "r" if mmap else None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+              for name in metadata["arrays"]}
+    return arrays, metadata
@@ -0,0 +1,151 @@
+"""ASGI serving mode for production.
+
+Runs the Flask routes of app.py under an ASGI server, executing each request
+on a pool of SERVER_THREADS threads so NumPy scoring (which releases the GIL)
+uses every core, while the event loop keeps accepting connections. At most
+SERVER_QUEUE_DEPTH further requests wait for a free thread; beyond that the
+server answers 503 immediately instead of queueing without bound.
+
+    MODEL_ARTIFACTS=artifacts uvicorn asgi:application --workers 4
+
+With MODEL_ARTIFACTS (or MODEL_SHARE_DIR) set, every worker process
+memory-maps the same read-only model, so extra workers cost little memory.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import app as music_app
+
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", str(os.cpu_count() or 4)))
+SERVER_QUEUE_DEPTH = int(os.environ.get("SERVER_QUEUE_DEPTH", "64"))
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope and request body into a WSGI environ"""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(wsgi_app, environ):
+    """Run a WSGI app to completion; returns (status code, headers, body)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                               for name, value in headers]
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return response["status"], response["headers"], body
+
+
+class BoundedWsgiApplication:
+    """ASGI application running a WSGI app on a bounded thread pool"""
+
+    def __init__(self, wsgi_app, threads=SERVER_THREADS, queue_depth=SERVER_QUEUE_DEPTH,
+                 on_startup=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.limit = threads + queue_depth
+        self.on_startup = on_startup
+        self.executor = None
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="scoring")
+        return self.executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    if self.on_startup:
+                        await asyncio.get_running_loop().run_in_executor(self._executor(), self.on_startup)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.executor:
+                    self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        # Shed load before reading the body when every thread and queue slot is taken
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            await self._send(send, 503, [(b"content-type", b"application/json"), (b"retry-after", b"1")],
+                             json.dumps({"error": "Server busy, please retry"}).encode())
+            return
+
+        self.in_flight += 1
+        try:
+            body = bytearray()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+
+            environ = build_environ(scope, bytes(body))
+            status, headers, content = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), run_wsgi, self.wsgi_app, environ)
+            await self._send(send, status, headers, content)
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    async def _send(send, status, headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+application = BoundedWsgiApplication(music_app.app, on_startup=music_app.init_model)
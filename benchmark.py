@@ -0,0 +1,267 @@
+"""Benchmark harness for the load, train, search and recommend hot paths.
+
+Synthetic catalogs with the schema of app.create_sample_data are generated at
+each requested size and every size runs in a fresh process, so peak RSS is
+measured per size. Latency percentiles, throughput, CPU time and peak RSS are
+printed and written as JSON; pass --compare with an earlier results file to
+see the change per stage between versions.
+
+    python benchmark.py --sizes 5000,100000 --output bench_results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SIZES = [5_000, 100_000, 1_000_000, 5_000_000]
+
+# Value ranges of the audio features in create_sample_data
+FEATURE_RANGES = {
+    "valence": (0.0, 1.0),
+    "danceability": (0.0, 1.0),
+    "energy": (0.0, 1.0),
+    "tempo": (60.0, 200.0),
+    "acousticness": (0.0, 1.0),
+    "liveness": (0.0, 1.0),
+    "speechiness": (0.0, 1.0),
+    "instrumentalness": (0.0, 1.0),
+}
+
+SYLLABLES = ["la", "mo", "ri", "ta", "ven", "sol", "kai", "dor", "mi", "no", "blu", "ze",
+             "ra", "tho", "lin", "gar", "el", "sun", "ock", "fey", "pa", "quo", "wi", "ston"]
+
+
+def generate_catalog(size, seed=0):
+    """Return a synthetic catalog of size songs shaped like create_sample_data, plus popularity"""
+    rng = np.random.default_rng(seed)
+    syllables = np.array(SYLLABLES)
+    words = ["".join(rng.choice(syllables, rng.integers(1, 4))).capitalize() for _ in range(5000)]
+    words = np.array(words)
+
+    def phrases(count, max_words):
+        lengths = rng.integers(1, max_words + 1, count)
+        picks = rng.choice(words, lengths.sum()).tolist()
+        out = []
+        start = 0
+        for length in lengths.tolist():
+            out.append(" ".join(picks[start:start + length]))
+            start += length
+        return out
+
+    artists = np.array(phrases(max(1, size // 20), 3), dtype=object)
+    songs = {
+        "name": phrases(size, 4),
+        "artists": artists[rng.integers(0, len(artists), size)],
+        "year": rng.integers(1920, 2021, size),
+    }
+    for feature, (low, high) in FEATURE_RANGES.items():
+        songs[feature] = rng.uniform(low, high, size)
+    songs["popularity"] = rng.integers(0, 101, size)
+    return pd.DataFrame(songs)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def measure(results, stage):
+    """Record wall time, CPU time and peak RSS of the enclosed block"""
+    started, cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    results[stage] = {
+        "seconds": time.perf_counter() - started,
+        "cpu_seconds": time.process_time() - cpu,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure_requests(client, urls):
+    """Issue GET requests and summarize their latency, throughput and bytes"""
+    latencies = np.empty(len(urls))
+    total_bytes = 0
+    cpu = time.process_time()
+    started = time.perf_counter()
+    for i, url in enumerate(urls):
+        request_started = time.perf_counter()
+        response = client.get(url)
+        latencies[i] = time.perf_counter() - request_started
+        total_bytes += len(response.data)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "requests": len(urls),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "mean_ms": latencies.mean() * 1000,
+        "requests_per_sec": len(urls) / elapsed,
+        "cpu_ms_per_request": cpu * 1000 / len(urls),
+        "bytes_per_sec": total_bytes / elapsed,
+        "bytes_per_request": total_bytes / len(urls),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_size(size, requests, seed, workdir):
+    """Benchmark one catalog size; meant to run in its own process"""
+    import app
+    import catalog
+    from urllib.parse import quote
+
+    results = {"size": size}
+    catalog_dir = os.path.join(workdir, f"catalog-{size}")
+    with measure(results, "generate"):
+        catalog.write_catalog(generate_catalog(size, seed), catalog_dir)
+
+    with measure(results, "load"):
+        app.read_songs(catalog_dir)
+
+    # Full-catalog training plus index construction, as served
+    app.CATALOG_PATH = catalog_dir
+    app.SAMPLE_SIZE = 0
+    with measure(results, "train"):
+        app.load_and_process_data()
+    if len(app.df) != size:
+        raise RuntimeError(f"Expected {size} songs to be loaded, got {len(app.df)}")
+
+    # Measure the computation, not the response caches
+    app.recommend_cache.maxsize = 0
+    app.search_cache.maxsize = 0
+    client = app.app.test_client()
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, size, requests)
+    names = app.df['name'].to_numpy()[rows]
+    queries = []
+    for name in names:
+        length = min(len(name), int(rng.integers(2, 9)))
+        start = int(rng.integers(0, len(name) - length + 1))
+        queries.append(name[start:start + length])
+
+    results["search"] = measure_requests(client, [f"/api/search?q={quote(q)}" for q in queries])
+    results["recommend"] = measure_requests(
+        client, [f"/api/recommend?song={quote(name)}" for name in names])
+    results["recommend_by_id"] = measure_requests(
+        client, [f"/api/recommend?id={quote(song_id)}" for song_id in app.df['id'].to_numpy()[rows]])
+    decades = rng.integers(192, 202, requests) * 10
+    results["recommend_filtered"] = measure_requests(
+        client, [f"/api/recommend?id={quote(song_id)}&year_min={decade}&year_max={decade + 9}&min_popularity=50"
+                 for song_id, decade in zip(app.df['id'].to_numpy()[rows], decades)])
+    results["recommend_columnar"] = measure_requests(
+        client, [f"/api/recommend?id={quote(song_id)}&format=columnar"
+                 for song_id in app.df['id'].to_numpy()[rows]])
+    measure_serialization(results, app, rng, requests)
+    return results
+
+
+def measure_serialization(results, app, rng, requests):
+    """Time encoding recommendation-sized responses through each serialization path"""
+    import serialization
+
+    columns = ['id', 'name', 'year', 'artists', 'Cluster']
+    row_sets = [rng.integers(0, len(app.df), 10) for _ in range(requests)]
+    similarities = rng.random(10, dtype=np.float32)
+
+    # The previous path: a DataFrame per response, boxed by to_dict, stdlib json
+    with measure(results, "serialize_to_dict"):
+        for rows in row_sets:
+            frame = app.df.iloc[rows][columns].copy()
+            frame.insert(4, 'similarity', similarities.astype(float))
+            json.dumps({"recommendations": frame.to_dict('records')})
+    for name, shape in (("serialize_records", serialization.records), ("serialize_columnar", None)):
+        with measure(results, name):
+            for rows in row_sets:
+                gathered = serialization.gather(app.song_columns, rows, columns,
+                                                extra={'similarity': similarities})
+                serialization.dumps({"recommendations": shape(gathered) if shape else gathered})
+    results["serializer"] = "orjson" if serialization.orjson is not None else "json"
+
+
+def print_results(results, baseline=None):
+    """Print a table of results, with ratios to baseline when given"""
+    previous = {entry["size"]: entry for entry in (baseline or {}).get("sizes", [])}
+    for entry in results["sizes"]:
+        print(f"\n{entry['size']:,} songs")
+        old = previous.get(entry["size"], {})
+        for stage, values in entry.items():
+            if not isinstance(values, dict):
+                continue
+            if "p50_ms" in values:
+                line = (f"  {stage:<20} p50 {values['p50_ms']:8.3f} ms  p95 {values['p95_ms']:8.3f} ms  "
+                        f"p99 {values['p99_ms']:8.3f} ms  {values['requests_per_sec']:9.0f} req/s  "
+                        f"{values['bytes_per_sec'] / 1e6:7.2f} MB/s  rss {values['peak_rss_mb']:7.0f} MiB")
+                key = "p50_ms"
+            else:
+                line = (f"  {stage:<20} {values['seconds']:8.2f} s  cpu {values['cpu_seconds']:8.2f} s  "
+                        f"rss {values['peak_rss_mb']:7.0f} MiB")
+                key = "seconds"
+            if stage in old and old[stage].get(key):
+                line += f"  ({values[key] / old[stage][key]:.2f}x baseline)"
+            print(line)
+        if "serialize_to_dict" in entry:
+            to_dict = entry["serialize_to_dict"]["cpu_seconds"]
+            print(f"  serialization CPU ({entry['serializer']}): records "
+                  f"{to_dict / entry['serialize_records']['cpu_seconds']:.1f}x, columnar "
+                  f"{to_dict / entry['serialize_columnar']['cpu_seconds']:.1f}x faster than to_dict + json")
+        if "recommend_columnar" in entry:
+            saved = 1 - entry["recommend_columnar"]["bytes_per_request"] / entry["recommend_by_id"]["bytes_per_request"]
+            print(f"  columnar responses are {saved:.0%} smaller than records")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the music recommendation hot paths")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated catalog sizes")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per query benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier JSON results file to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "requests": args.requests,
+        "sizes": [],
+    }
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(",")):
+            print(f"Benchmarking {size:,} songs...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results["sizes"].append(pool.submit(run_size, size, args.requests, args.seed, workdir).result())
+            shutil.rmtree(os.path.join(workdir, f"catalog-{size}"), ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Columnar, memory-mappable song catalog.
+
+A catalog directory holds one raw binary file per numeric column and, for each
+string column, a UTF-8 byte buffer plus an int64 offsets file, described by
+catalog.json. Readers memory-map only the columns they ask for and touch only
+the pages of the rows they select, instead of parsing a whole CSV.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "catalog.json"
+
+
+def is_catalog(path):
+    """Return True if path is a catalog directory"""
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def convert_csv(csv_path, output_dir, columns, string_columns=("name", "artists"),
+                chunksize=100_000):
+    """Convert a (possibly compressed) CSV into a catalog holding only columns.
+
+    The CSV is streamed in chunks, so memory is bounded by chunksize.
+    Returns the number of rows written.
+    """
+    # Columns missing from the CSV are skipped
+    header = pd.read_csv(csv_path, nrows=0).columns
+    columns = [column for column in columns if column in header]
+    chunks = pd.read_csv(csv_path, usecols=columns, chunksize=chunksize)
+    return write_chunks(chunks, output_dir, columns, string_columns)
+
+
+def write_catalog(frame, output_dir, string_columns=("name", "artists"), chunksize=100_000):
+    """Write a DataFrame as a catalog; returns the number of rows written"""
+    chunks = (frame.iloc[start:start + chunksize] for start in range(0, len(frame), chunksize))
+    return write_chunks(chunks, output_dir, list(frame.columns), string_columns)
+
+
+def write_chunks(chunks, output_dir, columns, string_columns=("name", "artists")):
+    """Write an iterable of DataFrame chunks as a catalog holding only columns.
+
+    The catalog is staged next to output_dir and renamed into place once
+    complete. Returns the number of rows written.
+    """
+    staging = f"{output_dir.rstrip(os.sep)}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    files = {}
+    types = {}
+    string_ends = {column: 0 for column in columns if column in string_columns}
+    rows = 0
+    try:
+        for column in columns:
+            if column in string_columns:
+                files[column] = (open(os.path.join(staging, f"{column}.bytes"), "wb"),
+                                 open(os.path.join(staging, f"{column}.offsets"), "wb"))
+                files[column][1].write(np.zeros(1, dtype=np.int64).tobytes())
+            else:
+                files[column] = open(os.path.join(staging, f"{column}.bin"), "wb")
+
+        for chunk in chunks:
+            for column in columns:
+                if column in string_columns:
+                    data, offsets = files[column]
+                    encoded = [value.encode("utf-8") if isinstance(value, str) else b""
+                               for value in chunk[column]]
+                    ends = string_ends[column] + np.cumsum([len(value) for value in encoded],
+                                                           dtype=np.int64)
+                    data.write(b"".join(encoded))
+                    offsets.write(ends.tobytes())
+                    if len(ends):
+                        string_ends[column] = int(ends[-1])
+                    types[column] = "str"
+                else:
+                    values = chunk[column].to_numpy()
+                    # Keep the dtype of the first chunk so every chunk lines up
+                    dtype = np.dtype(types.setdefault(column, values.dtype.str))
+                    files[column].write(values.astype(dtype).tobytes())
+            rows += len(chunk)
+    finally:
+        for handle in files.values():
+            for f in handle if isinstance(handle, tuple) else (handle,):
+                f.close()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "rows": rows,
+        "columns": {column: {"type": types.get(column, "str" if column in string_columns else "<f8")}
+                    for column in columns},
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(staging, output_dir)
+    return rows
+
+
+def read_manifest(path):
+    """Return the manifest of the catalog at path"""
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported catalog format {manifest.get('format_version')} in {path}")
+    return manifest
+
+
+def _memmap(path, dtype, shape=None):
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.zeros(shape or 0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def _read_strings(path, column, size, rows):
+    offsets = _memmap(os.path.join(path, f"{column}.offsets"), np.int64, (size + 1,))
+    data = _memmap(os.path.join(path, f"{column}.bytes"), np.uint8)
+    if rows is None:
+        buffer = data.tobytes()
+        bounds = offsets.tolist()
+        return [buffer[start:end].decode("utf-8") for start, end in zip(bounds[:-1], bounds[1:])]
+    starts = offsets[rows].tolist()
+    ends = offsets[np.asarray(rows) + 1].tolist()
+    return [data[start:end].tobytes().decode("utf-8") for start, end in zip(starts, ends)]
+
+
+def read_catalog(path, columns=None, rows=None):
+    """Read a catalog into a DataFrame.
+
+    columns limits the columns that are read; rows is a slice or an array of
+    row positions, in which case only those rows are materialized.
+    """
+    manifest = read_manifest(path)
+    size = manifest["rows"]
+    columns = list(columns or manifest["columns"])
+    if isinstance(rows, slice):
+        rows = np.arange(size)[rows]
+
+    data = {}
+    for column in columns:
+        kind = manifest["columns"][column]["type"]
+        if kind == "str":
+            data[column] = _read_strings(path, column, size, rows)
+        else:
+            values = _memmap(os.path.join(path, f"{column}.bin"), np.dtype(kind), (size,))
+            data[column] = np.array(values if rows is None else values[rows])
+    return pd.DataFrame(data, columns=columns)
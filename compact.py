@@ -0,0 +1,222 @@
+"""Compact in-memory representations of catalog columns.
+
+Strings that are unique per song (ids and names) are held in PackedStrings:
+one UTF-8 byte buffer plus int64 offsets, kept as a pandas column through the
+extension array interface. Compared to an object column this saves the
+~50-byte header and the pointer of every Python string, and a buffer loaded
+from model artifacts stays memory-mapped, so worker processes share its
+pages. Values are decoded to str only when a row is read.
+
+Song ids are found through a string index: the 64-bit FNV-1a hashes of the
+values in sorted order with their rows, instead of a dict with a million str
+keys.
+"""
+import numbers
+
+import numpy as np
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype
+from pandas.api.indexers import check_array_indexer
+from pandas.core.strings.object_array import ObjectStringArrayMixin
+
+import artifacts
+
+FNV_OFFSET = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+_MASK = (1 << 64) - 1
+
+
+@register_extension_dtype
+class PackedStringDtype(ExtensionDtype):
+    """pandas dtype of PackedStrings columns"""
+
+    name = "packed_string"
+    type = str
+    kind = "O"
+
+    @classmethod
+    def construct_array_type(cls):
+        return PackedStrings
+
+
+class PackedStrings(ObjectStringArrayMixin, ExtensionArray):
+    """Immutable strings stored as one UTF-8 buffer plus offsets.
+
+    Offsets index data directly, so slices share the buffer. Missing values
+    are stored as empty strings. The .str accessor methods work on the
+    values decoded to an object array.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        return cls(*artifacts.encode_strings(scalars))
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls._from_sequence(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        data = [array.data[array.offsets[0]:array.offsets[-1]] for array in to_concat]
+        offsets = [np.zeros(1, dtype=np.int64)]
+        end = 0
+        for array in to_concat:
+            offsets.append(array.offsets[1:] - array.offsets[0] + end)
+            end += array.offsets[-1] - array.offsets[0]
+        return cls(np.concatenate(data) if data else np.empty(0, dtype=np.uint8), np.concatenate(offsets))
+
+    @property
+    def dtype(self):
+        return PackedStringDtype()
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if isinstance(item, numbers.Integral):
+            row = int(item) + len(self) if item < 0 else int(item)
+            if not 0 <= row < len(self):
+                raise IndexError(f"index {item} is out of bounds for size {len(self)}")
+            return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                return PackedStrings(self.data, self.offsets[start:max(start, stop) + 1])
+            item = np.arange(start, stop, step)
+        item = check_array_indexer(self, item)
+        if item.dtype == bool:
+            item = np.flatnonzero(item)
+        return self.take(item)
+
+    def __iter__(self):
+        base = self.offsets[0]
+        data = self.data[base:self.offsets[-1]].tobytes()
+        bounds = (self.offsets - base).tolist()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            yield data[start:end].decode("utf-8")
+
+    def __array__(self, dtype=None, copy=None):
+        values = np.empty(len(self), dtype=object)
+        values[:] = list(self)
+        return values if dtype is None else values.astype(dtype)
+
+    def __eq__(self, other):
+        return np.asarray(self) == (np.asarray(other, dtype=object) if isinstance(other, ExtensionArray) else other)
+
+    def isna(self):
+        return np.zeros(len(self), dtype=bool)
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        indices = np.asarray(indices, dtype=np.int64)
+        missing = np.zeros(len(indices), dtype=bool)
+        if allow_fill:
+            if (indices < -1).any():
+                raise ValueError("Invalid value in 'indices'; only -1 marks a missing value")
+            missing = indices == -1
+        else:
+            indices = np.where(indices < 0, indices + len(self), indices)
+        present = indices[~missing]
+        if ((present < 0) | (present >= len(self))).any():
+            raise IndexError("Index out of bounds for PackedStrings")
+
+        rows = np.where(missing, 0, indices)
+        starts = self.offsets[rows]
+        lengths = np.where(missing, 0, self.offsets[rows + 1] - starts)
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        return PackedStrings(self.data[positions], offsets)
+
+    def take_list(self, rows):
+        """Return the values at rows as a list of str; faster than take(rows).tolist()"""
+        rows = np.asarray(rows, dtype=np.int64)
+        data = memoryview(self.data)
+        return [str(data[start:end], "utf-8")
+                for start, end in zip(self.offsets[rows].tolist(), self.offsets[rows + 1].tolist())]
+
+    def equal_at(self, rows, value):
+        """Return whether each of rows holds value, comparing bytes without decoding"""
+        rows = np.asarray(rows, dtype=np.int64)
+        value = value.encode("utf-8")
+        starts = self.offsets[rows]
+        equal = self.offsets[rows + 1] - starts == len(value)
+        data = memoryview(self.data)
+        same_length = np.flatnonzero(equal)
+        for i, start in zip(same_length.tolist(), starts[same_length].tolist()):
+            equal[i] = data[start:start + len(value)] == value
+        return equal
+
+    def copy(self):
+        return PackedStrings(self.data[self.offsets[0]:self.offsets[-1]].copy(), self.offsets - self.offsets[0])
+
+
+def fnv1a(value):
+    """Return the 64-bit FNV-1a hash of a str"""
+    hashed = FNV_OFFSET
+    for byte in value.encode("utf-8"):
+        hashed = ((hashed ^ byte) * FNV_PRIME) & _MASK
+    return hashed
+
+
+def fnv1a_column(strings):
+    """Return the 64-bit FNV-1a hashes of every value of a PackedStrings, vectorized by byte position"""
+    starts = strings.offsets[:-1]
+    lengths = np.diff(strings.offsets)
+    hashes = np.full(len(strings), FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV_PRIME)
+    for position in range(int(lengths.max()) if len(lengths) else 0):
+        rows = np.flatnonzero(lengths > position)
+        hashes[rows] = (hashes[rows] ^ strings.data[starts[rows] + position]) * prime
+    return hashes
+
+
+def build_string_index(strings):
+    """Index the rows of a PackedStrings by value, for string_index_lookup"""
+    hashes = fnv1a_column(strings)
+    order = np.argsort(hashes, kind="stable")
+    return {"hashes": hashes[order], "rows": order.astype(np.int32 if len(order) < 2**31 else np.int64)}
+
+
+def string_index_lookup(index, strings, value):
+    """Return the first row of strings equal to value, or None"""
+    hashed = np.uint64(fnv1a(value))
+    hashes = index["hashes"]
+    i = int(np.searchsorted(hashes, hashed))
+    while i < len(hashes) and hashes[i] == hashed:
+        row = int(index["rows"][i])
+        if strings[row] == value:
+            return row
+        i += 1
+    return None
+
+
+def string_index_add(index, strings):
+    """Return index extended with strings, whose rows follow the indexed ones"""
+    start = len(index["rows"])
+    hashes = fnv1a_column(strings)
+    order = np.argsort(hashes, kind="stable")
+    # After equal hashes, so an already indexed row stays ahead of a new row with the same id
+    at = np.searchsorted(index["hashes"], hashes[order], side="right")
+    return {"hashes": np.insert(index["hashes"], at, hashes[order]),
+            "rows": np.insert(index["rows"], at, (start + order).astype(index["rows"].dtype))}
+
+
+def smallest_int_dtype(values):
+    """Return the narrowest signed integer dtype holding every value"""
+    values = np.asarray(values)
+    if not len(values):
+        return np.dtype(np.int8)
+    low, high = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
@@ -0,0 +1,182 @@
+"""Offline export of the top-k similar songs for every song in the catalog.
+
+Reads a model built by `python app.py build` and computes exact neighbours
+with blocked matrix multiplication (vector_index.blocked_top_k) on a pool of
+worker processes. Each worker memory-maps the model and writes its blocks of
+query rows straight into the output files, so memory per worker is bounded by
+--block-size x --corpus-block scores. Finished blocks are recorded in a
+checkpoint, and rerunning the same command resumes where it stopped.
+
+    python export.py --artifacts artifacts --output neighbors -k 20
+
+The output directory holds:
+
+    manifest.json       rows, k, dtypes and the source model version
+    neighbors.bin       rows x k int32 neighbour rows, best first (-1 = none)
+    scores.bin          rows x k float32 cosine similarities
+    id.bytes/.offsets   song ids by row (see artifacts.decode_strings)
+    checkpoint.json     blocks finished so far
+
+Use read_export to load it.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+import artifacts
+import vector_index
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CHECKPOINT_FILE = "checkpoint.json"
+
+_worker = {}
+
+
+def _init_worker(artifact_path, output_dir, k, corpus_block):
+    # One BLAS thread per worker; the pool provides the parallelism
+    _worker["thread_limits"] = threadpool_limits(1)
+    arrays, _ = artifacts.load_artifacts(artifact_path)
+    rows = len(arrays["ivf_vectors"])
+    _worker.update(
+        vectors=arrays["ivf_vectors"],
+        neighbors=np.memmap(os.path.join(output_dir, "neighbors.bin"), dtype=np.int32, mode="r+", shape=(rows, k)),
+        scores=np.memmap(os.path.join(output_dir, "scores.bin"), dtype=np.float32, mode="r+", shape=(rows, k)),
+        k=k,
+        corpus_block=corpus_block,
+    )
+
+
+def export_block(start, end):
+    """Compute and write the neighbours of rows [start, end); runs in a worker"""
+    neighbors, scores = vector_index.blocked_top_k(
+        _worker["vectors"], np.arange(start, end), _worker["k"], _worker["corpus_block"]
+    )
+    _worker["neighbors"][start:end] = neighbors
+    _worker["scores"][start:end] = scores
+    _worker["neighbors"].flush()
+    _worker["scores"].flush()
+    return start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write_json(path, data):
+    # Write then rename, so an interrupted job never leaves a torn file
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def prepare_output(output_dir, arrays, metadata, k, block_size, restart=False):
+    """Create the output files, or validate them for resuming; returns the finished block starts"""
+    rows = len(arrays["ivf_vectors"])
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "rows": rows,
+        "k": k,
+        "block_size": block_size,
+        "source_version": metadata["version"],
+        "dtypes": {"neighbors": "<i4", "scores": "<f4"},
+    }
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+
+    if not restart and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            existing = json.load(f)
+        if existing != manifest:
+            raise ValueError(f"{output_dir} holds an export with different settings "
+                             f"({existing}); pass --restart to overwrite it")
+        with open(checkpoint_path) as f:
+            return set(json.load(f)["done"])
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, dtype in (("neighbors.bin", np.int32), ("scores.bin", np.float32)):
+        # Sized up front (sparse where supported) so workers can fill any block
+        with open(os.path.join(output_dir, name), "wb") as f:
+            f.truncate(rows * k * np.dtype(dtype).itemsize)
+    for name in ("id_bytes", "id_offsets"):
+        np.asarray(arrays[name]).tofile(os.path.join(output_dir, name.replace("_", ".")))
+    _write_json(checkpoint_path, {"done": []})
+    _write_json(manifest_path, manifest)
+    return set()
+
+
+def run_export(artifact_path, output_dir, k=20, block_size=1024, corpus_block=65536, workers=None,
+               restart=False, log=print):
+    """Export the top-k neighbours of every song; returns a summary with throughput"""
+    arrays, metadata = artifacts.load_artifacts(artifact_path)
+    rows = len(arrays["ivf_vectors"])
+    done = prepare_output(output_dir, arrays, metadata, k, block_size, restart)
+    pending = [start for start in range(0, rows, block_size) if start not in done]
+    workers = workers or os.cpu_count() or 1
+    log(f"Exporting {k} neighbours for {rows} songs: {len(pending)} of "
+        f"{-(-rows // block_size)} blocks left, {workers} workers")
+
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    started = time.perf_counter()
+    exported = 0
+    worker_rss = 0.0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(artifact_path, output_dir, k, corpus_block)) as pool:
+        futures = [pool.submit(export_block, start, min(start + block_size, rows)) for start in pending]
+        for future in as_completed(futures):
+            start, rss = future.result()
+            done.add(start)
+            _write_json(checkpoint_path, {"done": sorted(done)})
+            exported += min(start + block_size, rows) - start
+            worker_rss = max(worker_rss, rss)
+            elapsed = time.perf_counter() - started
+            log(f"  {len(done) * 100 // -(-rows // block_size):3d}% {exported / elapsed:10.0f} songs/s")
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "rows": rows,
+        "exported": exported,
+        "seconds": elapsed,
+        "songs_per_sec": exported / elapsed if elapsed else 0.0,
+        "peak_worker_rss_mb": worker_rss,
+    }
+    log(f"Exported {exported} songs in {elapsed:.1f} s ({summary['songs_per_sec']:.0f} songs/s), "
+        f"peak worker RSS {worker_rss:.0f} MiB")
+    return summary
+
+
+def read_export(output_dir):
+    """Return (ids, neighbors, scores) of an export; the matrices are memory-mapped"""
+    with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported export format {manifest.get('format_version')} in {output_dir}")
+    shape = (manifest["rows"], manifest["k"])
+    ids = artifacts.decode_strings(np.fromfile(os.path.join(output_dir, "id.bytes"), dtype=np.uint8),
+                                   np.fromfile(os.path.join(output_dir, "id.offsets"), dtype=np.int64))
+    neighbors = np.memmap(os.path.join(output_dir, "neighbors.bin"), dtype=np.int32, mode="r", shape=shape)
+    scores = np.memmap(os.path.join(output_dir, "scores.bin"), dtype=np.float32, mode="r", shape=shape)
+    return ids, neighbors, scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the top-k similar songs of every song")
+    parser.add_argument("--artifacts", default=os.environ.get("MODEL_ARTIFACTS", "artifacts"),
+                        help="model artifact root or version directory")
+    parser.add_argument("--output", default="neighbors", help="export directory")
+    parser.add_argument("-k", type=int, default=20, help="neighbours per song")
+    parser.add_argument("--block-size", type=int, default=1024, help="query songs per task")
+    parser.add_argument("--corpus-block", type=int, default=65536, help="catalog songs scored per step")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--restart", action="store_true", help="discard any checkpoint and start over")
+    args = parser.parse_args()
+    run_export(args.artifacts, args.output, args.k, args.block_size, args.corpus_block,
+               args.workers, args.restart)
+
+
+if __name__ == '__main__':
+    main()
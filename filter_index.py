@@ -0,0 +1,226 @@
+"""Precomputed indexes for filtering recommendations by year, popularity and artist.
+
+Years and popularity are kept as sorted-order arrays, so a range is two binary
+searches and a slice of row ids. Artists are factorized, and the rows of every
+distinct artists value are stored contiguously (CSR), with a lookup from each
+individual artist name to the values that contain it. A query's filters are
+combined by intersecting the sorted row ids they select, which
+vector_index.search restricts its candidates to.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# Items of a Python list literal such as "['Artist A', \"Artist B\"]"
+_LIST_ITEM = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+
+
+def artist_names(value):
+    """Return the lowercased individual artist names credited by an artists value.
+
+    The dataset stores artists as a list literal like "['A', 'B']"; any other
+    value is a single name.
+    """
+    value = str(value).strip()
+    if value.startswith("[") and value.endswith("]"):
+        names = {(single or double).strip().lower() for single, double in _LIST_ITEM.findall(value)}
+        if names:
+            return names
+    return {value.lower()}
+
+
+def split_artists(value):
+    """Return the lowercased names an artists value can be matched by: each
+    individual name, and the whole value"""
+    return artist_names(value) | {str(value).strip().lower()}
+
+
+def build_filter_index(years, artists, popularity=None):
+    """Build the filter index over per-row years, artists values and popularity"""
+    codes, values = pd.factorize(np.asarray(artists, dtype=object), use_na_sentinel=False)
+    artist_rows = np.argsort(codes, kind="stable")
+    artist_offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(values)), out=artist_offsets[1:])
+
+    years = np.asarray(years)
+    year_order = np.argsort(years, kind="stable")
+    popularity_order = None
+    if popularity is not None:
+        popularity = np.asarray(popularity)
+        popularity_order = np.argsort(popularity, kind="stable")
+    return restore_filter_index(years, list(values), year_order, artist_rows, artist_offsets,
+                                popularity, popularity_order)
+
+
+def restore_filter_index(years, artist_values, year_order, artist_rows, artist_offsets,
+                         popularity=None, popularity_order=None, years_sorted=None, popularity_sorted=None):
+    """Rebuild a filter index from the arrays of a built one (e.g. loaded from artifacts)
+
+    The sorted years and popularity are gathered again when not given.
+    """
+    lookup = {}
+    for code, value in enumerate(artist_values):
+        for name in split_artists(value):
+            lookup.setdefault(name, []).append(code)
+
+    return {
+        "size": len(years),
+        "years": np.asarray(years),
+        "popularity": None if popularity is None else np.asarray(popularity),
+        "year_order": year_order,
+        "years_sorted": np.asarray(years)[year_order] if years_sorted is None else years_sorted,
+        "popularity_order": popularity_order,
+        "popularity_sorted": (popularity_sorted if popularity_sorted is not None or popularity_order is None
+                              else np.asarray(popularity)[popularity_order]),
+        "artist_values": artist_values,
+        "artist_rows": artist_rows,
+        "artist_offsets": artist_offsets,
+        "artist_lookup": {name: np.array(codes, dtype=np.int64) for name, codes in lookup.items()},
+    }
+
+
+def _insert_sorted(order, sorted_values, rows, values):
+    """Return order and sorted_values with rows (after every indexed row) merged in by value"""
+    values = np.asarray(values)
+    sorted_values = sorted_values.astype(np.result_type(sorted_values.dtype, values.dtype), copy=False)
+    by_value = np.argsort(values, kind="stable")
+    # After the indexed rows of equal value, as a stable sort of all rows would place them
+    at = np.searchsorted(sorted_values, values[by_value], side="right")
+    return (np.insert(order, at, rows[by_value].astype(order.dtype)),
+            np.insert(sorted_values, at, values[by_value].astype(sorted_values.dtype)))
+
+
+def add_rows(index, years, artists, popularity=None):
+    """Return a new index that also covers rows appended after the indexed ones.
+
+    Equal to build_filter_index over all rows, but only the new rows are
+    sorted and factorized; they are merged into copies of the existing arrays.
+    """
+    start = index["size"]
+    rows = np.arange(start, start + len(years))
+    year_order, years_sorted = _insert_sorted(index["year_order"], index["years_sorted"], rows, years)
+    popularity_order, popularity_sorted = index["popularity_order"], index["popularity_sorted"]
+    if popularity_order is not None:
+        popularity_order, popularity_sorted = _insert_sorted(popularity_order, popularity_sorted, rows, popularity)
+
+    # New artists values get the next codes, in order of first appearance
+    artist_values = list(index["artist_values"])
+    lookup = dict(index["artist_lookup"])
+    known = {value: code for code, value in enumerate(artist_values)}
+    codes = np.empty(len(rows), dtype=np.int64)
+    for i, value in enumerate(np.asarray(artists, dtype=object)):
+        code = known.get(value)
+        if code is None:
+            code = known[value] = len(artist_values)
+            artist_values.append(value)
+            for name in split_artists(value):
+                lookup[name] = np.append(lookup.get(name, np.empty(0, dtype=np.int64)), code)
+        codes[i] = code
+
+    # Each new row goes after the existing rows of its value
+    old_counts = np.zeros(len(artist_values), dtype=np.int64)
+    old_counts[:len(index["artist_offsets"]) - 1] = np.diff(index["artist_offsets"])
+    old_ends = np.cumsum(old_counts)
+    by_code = np.argsort(codes, kind="stable")
+    artist_rows = np.insert(index["artist_rows"], old_ends[codes[by_code]],
+                            rows[by_code].astype(index["artist_rows"].dtype))
+    artist_offsets = np.zeros(len(artist_values) + 1, dtype=np.int64)
+    np.cumsum(old_counts + np.bincount(codes, minlength=len(artist_values)), out=artist_offsets[1:])
+
+    return {
+        "size": start + len(rows),
+        "years": np.concatenate([index["years"], np.asarray(years)]),
+        "popularity": (None if popularity_order is None
+                       else np.concatenate([index["popularity"], np.asarray(popularity)])),
+        "year_order": year_order,
+        "years_sorted": years_sorted,
+        "popularity_order": popularity_order,
+        "popularity_sorted": popularity_sorted,
+        "artist_values": artist_values,
+        "artist_rows": artist_rows,
+        "artist_offsets": artist_offsets,
+        "artist_lookup": lookup,
+    }
+
+
+def _range_bounds(sorted_values, low=None, high=None):
+    """Return the slice of sorted_values whose values lie in [low, high]; either bound may be None"""
+    start = 0 if low is None else np.searchsorted(sorted_values, low, side="left")
+    end = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side="right")
+    return slice(start, max(start, end))
+
+
+def _artist_codes(index, names):
+    """Return the codes of the artists values crediting any of the given names (case-insensitive)"""
+    codes = [index["artist_lookup"].get(name.strip().lower(), np.empty(0, dtype=np.int64)) for name in names]
+    return np.unique(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+
+
+def artist_rows(index, names):
+    """Return the rows credited to any of the given artist names (case-insensitive)"""
+    codes = _artist_codes(index, names)
+    offsets = index["artist_offsets"]
+    if not len(codes):
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate([index["artist_rows"][offsets[code]:offsets[code + 1]] for code in codes])
+
+
+def filter_rows(index, year_min=None, year_max=None, min_popularity=None, artists=None, exclude_artists=None):
+    """Return (allowed, excluded) sorted row ids for the given filters.
+
+    allowed holds the rows passing every inclusive filter, with excluded
+    artists already removed, or is None if there is no inclusive filter;
+    excluded then holds the rows of exclude_artists (or None), for the search
+    to skip. Only the rows of the filter selecting the fewest are gathered;
+    the other filters test just those, so the cost follows the narrowest one.
+    """
+    # (row count, rows(), passes(rows)) per inclusive filter
+    selections = []
+    if year_min is not None or year_max is not None:
+        years = _range_bounds(index["years_sorted"], year_min, year_max)
+        selections.append((years.stop - years.start, lambda: index["year_order"][years],
+                           lambda rows: _in_range(index["years"][rows], year_min, year_max)))
+    if min_popularity is not None:
+        if index["popularity_order"] is None:
+            raise ValueError("The catalog has no popularity column")
+        popular = _range_bounds(index["popularity_sorted"], min_popularity)
+        selections.append((popular.stop - popular.start, lambda: index["popularity_order"][popular],
+                           lambda rows: _in_range(index["popularity"][rows], min_popularity)))
+    if artists:
+        codes = _artist_codes(index, artists)
+        offsets = index["artist_offsets"]
+        selections.append((int((offsets[codes + 1] - offsets[codes]).sum()), lambda: artist_rows(index, artists),
+                           lambda rows: np.isin(rows, artist_rows(index, artists))))
+
+    excluded = np.unique(artist_rows(index, exclude_artists)) if exclude_artists else None
+    if not selections:
+        return None, excluded
+
+    selections.sort(key=lambda selection: selection[0])
+    allowed = _sorted_rows(selections[0][1](), index["size"])
+    for _, _, passes in selections[1:]:
+        allowed = allowed[passes(allowed)]
+    if excluded is not None:
+        allowed = allowed[~np.isin(allowed, excluded)]
+    return allowed, None
+
+
+def _sorted_rows(rows, size):
+    """Return rows sorted and deduplicated"""
+    if len(rows) * 8 < size:
+        return np.unique(rows)
+    # Sorting most of the catalog is slower than one pass over a row mask
+    selected = np.zeros(size, dtype=bool)
+    selected[rows] = True
+    return np.flatnonzero(selected)
+
+
+def _in_range(values, low=None, high=None):
+    """Return whether each of values lies in [low, high]; either bound may be None"""
+    passes = np.ones(len(values), dtype=bool)
+    if low is not None:
+        passes &= values >= low
+    if high is not None:
+        passes &= values <= high
+    return passes
@@ -0,0 +1,137 @@
+"""Zero-downtime model reloads.
+
+A Reloader builds a new model snapshot on a background thread while the old
+one keeps serving, then installs it under the write side of a ReadWriteLock.
+Requests hold the read side for their whole duration, so the swap waits for
+in-flight requests to finish on the old snapshot and no request ever sees a
+mix of the two. Only one build runs at a time, so at most two snapshots are
+alive at once.
+"""
+import threading
+import time
+import traceback
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers block new readers"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+
+class Reloader:
+    """Builds snapshots with build() in the background and installs them with install()"""
+
+    def __init__(self, build, install):
+        self.build = build
+        self.install = install
+        self._running = threading.Lock()
+        self.state = "idle"
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.reloads = 0
+
+    def start(self):
+        """Start a reload in the background; returns False if one is already running"""
+        if not self._running.acquire(blocking=False):
+            return False
+        self.state = "building"
+        self.started_at = time.time()
+        self.error = None
+        threading.Thread(target=self._run, name="model-reload", daemon=True).start()
+        return True
+
+    def apply(self, build):
+        """Build and install a snapshot synchronously with build().
+
+        Shares the single-build guard with start(), so it never races a
+        reload. Returns the installed snapshot, or None without calling build
+        if a reload is already running.
+        """
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            snapshot = build()
+            self.install(snapshot)
+            return snapshot
+        finally:
+            self._running.release()
+
+    def _run(self):
+        try:
+            snapshot = self.build()
+            self.state = "installing"
+            self.install(snapshot)
+            # Drop our reference so only the installed snapshot stays alive
+            del snapshot
+            self.reloads += 1
+            self.state = "idle"
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.finished_at = time.time()
+            self._running.release()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "reloads": self.reloads,
+        }
+
+
+def watch(poll, on_change, interval):
+    """Call on_change() whenever poll() returns a new value, checking every interval seconds
+
+    on_change returns whether it took the change (as Reloader.start does); a
+    change it declines, e.g. while another reload is running, is retried at
+    the next check.
+    """
+    def loop():
+        last = poll()
+        while True:
+            time.sleep(interval)
+            try:
+                current = poll()
+            except Exception as e:
+                print(f"Error polling for model changes: {e}")
+                continue
+            if current != last and on_change():
+                last = current
+
+    thread = threading.Thread(target=loop, name="model-watch", daemon=True)
+    thread.start()
+    return thread
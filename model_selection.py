@@ -0,0 +1,144 @@
+"""Choosing the number of clusters with a parallel k sweep.
+
+Every (k, seed) pair is one single-initialisation KMeans fit, and the fits run
+side by side on a pool of worker processes, so a sweep takes about as long as
+the slowest single fit on a box with enough cores. Each fit is scored by its
+inertia (mean squared distance to the centroids) and by its silhouette on a
+fixed-size sample, which keeps scoring linear in the catalog size. Finished
+fits, centroids included, are cached on disk keyed by the data, k, seed and
+sample sizes, so widening a sweep only fits the new pairs.
+
+The elbow of the inertia curve picks k by default; the best silhouette can be
+used instead. The chosen fit's centroids are returned so training can start
+from them instead of refitting.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+
+CRITERIA = ("elbow", "silhouette")
+
+_worker = {}
+
+
+def _init_worker(features):
+    # One BLAS/OpenMP thread per worker; the pool provides the parallelism
+    _worker["thread_limits"] = threadpool_limits(1)
+    _worker["features"] = features
+
+
+def fit_k(k, seed, silhouette_sample):
+    """Fit one KMeans and score it; runs in a worker"""
+    features = _worker["features"]
+    started = time.perf_counter()
+    kmeans = KMeans(n_clusters=k, random_state=seed, n_init=1).fit(features)
+    silhouette = silhouette_score(
+        features, kmeans.labels_, sample_size=min(silhouette_sample, len(features)), random_state=seed
+    )
+    return {
+        "k": k,
+        "seed": seed,
+        "inertia": float(kmeans.inertia_) / len(features),
+        "silhouette": float(silhouette),
+        "iterations": int(kmeans.n_iter_),
+        "seconds": time.perf_counter() - started,
+        "centroids": kmeans.cluster_centers_.tolist(),
+    }
+
+
+def _cache_path(cache_dir, fingerprint, k, seed, silhouette_sample):
+    return os.path.join(cache_dir, f"{fingerprint}-k{k}-s{seed}-n{silhouette_sample}.json")
+
+
+def elbow(ks, inertias):
+    """Return the k furthest below the straight line joining the ends of the inertia curve"""
+    ks = np.asarray(ks, dtype=np.float64)
+    inertias = np.asarray(inertias, dtype=np.float64)
+    if len(ks) < 3 or inertias[0] == inertias[-1]:
+        return int(ks[np.argmin(inertias)])
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (inertias - inertias[-1]) / (inertias[0] - inertias[-1])
+    return int(ks[np.argmax((1 - x) - y)])
+
+
+def select_k(features, ks, seeds=(42,), silhouette_sample=10_000, criterion="elbow", workers=None,
+             cache_dir=None, log=print):
+    """Sweep ks over features and return the chosen k with per-k diagnostics.
+
+    Each k keeps its best-inertia seed, as KMeans does with n_init. The result
+    is a JSON-serializable dict suitable for artifact metadata; its centroids
+    are those of the chosen fit.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"criterion must be one of {CRITERIA}")
+    features = np.ascontiguousarray(features, dtype=np.float64)
+    ks = sorted(set(int(k) for k in ks))
+    fingerprint = hashlib.blake2b(features.tobytes(), digest_size=8).hexdigest()
+    started = time.perf_counter()
+
+    fits, pending = [], []
+    for k in ks:
+        for seed in seeds:
+            path = cache_dir and _cache_path(cache_dir, fingerprint, k, seed, silhouette_sample)
+            fit = None
+            if path and os.path.exists(path):
+                with open(path) as f:
+                    fit = json.load(f)
+            # Fits cached before centroids were kept are fitted again
+            if fit and "centroids" in fit:
+                fits.append(fit)
+            else:
+                pending.append((k, seed))
+    log(f"Sweeping k={ks[0]}..{ks[-1]} x {len(seeds)} seeds on {len(features)} songs: "
+        f"{len(fits)} cached, {len(pending)} to fit")
+
+    if pending:
+        workers = min(workers or os.cpu_count() or 1, len(pending))
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(features,)) as pool:
+            # Largest k first: they take longest, so they should not start last
+            futures = [pool.submit(fit_k, k, seed, silhouette_sample)
+                       for k, seed in sorted(pending, reverse=True)]
+            for future in as_completed(futures):
+                fit = future.result()
+                fits.append(fit)
+                log(f"  k={fit['k']:<3} seed={fit['seed']:<4} inertia={fit['inertia']:.4f} "
+                    f"silhouette={fit['silhouette']:.4f} ({fit['seconds']:.1f}s)")
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    with open(_cache_path(cache_dir, fingerprint, fit["k"], fit["seed"], silhouette_sample), "w") as f:
+                        json.dump(fit, f)
+
+    best = {}
+    for fit in fits:
+        if fit["k"] not in best or fit["inertia"] < best[fit["k"]]["inertia"]:
+            best[fit["k"]] = fit
+    diagnostics = [{key: value for key, value in best[k].items() if key != "centroids"} for k in ks]
+    if criterion == "elbow":
+        chosen = elbow(ks, [fit["inertia"] for fit in diagnostics])
+    else:
+        chosen = max(diagnostics, key=lambda fit: fit["silhouette"])["k"]
+
+    elapsed = time.perf_counter() - started
+    log(f"Chose k={chosen} by {criterion} in {elapsed:.1f}s "
+        f"(slowest single fit {max(fit['seconds'] for fit in fits):.1f}s)")
+    return {
+        "k": chosen,
+        "criterion": criterion,
+        "songs": len(features),
+        "seeds": list(seeds),
+        "silhouette_sample": silhouette_sample,
+        "seconds": elapsed,
+        "seed": best[chosen]["seed"],
+        "centroids": best[chosen]["centroids"],
+        "diagnostics": diagnostics,
+    }
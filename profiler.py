@@ -0,0 +1,95 @@
+"""Opt-in sampling profiler for slow requests.
+
+While enabled, a background thread samples the Python stack of every thread
+that is serving a request every `interval` seconds. When a request ends after
+more than `threshold` seconds, its samples are written to `output_dir` in the
+collapsed-stack format ("outer;inner;leaf count" per line) read by
+flamegraph.pl, speedscope and inferno. Faster requests are discarded, so the
+cost is one stack walk per active request per interval.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def collapse(frame):
+    """Return frame's stack as one collapsed-stack line, outermost call first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """Samples request threads and keeps the stacks of requests slower than threshold"""
+
+    def __init__(self, threshold=0.5, interval=0.005, output_dir="profiles"):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_dir = output_dir
+        self.enabled = False
+        self.profiles_written = 0
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def enable(self, threshold=None):
+        if threshold is not None:
+            self.threshold = threshold
+        self.enabled = True
+        with self._lock:
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+                self._sampler.start()
+
+    def disable(self):
+        self.enabled = False
+        with self._lock:
+            self._active.clear()
+
+    def begin(self):
+        """Start sampling the calling thread"""
+        if self.enabled:
+            with self._lock:
+                self._active[threading.get_ident()] = Counter()
+
+    def end(self, label, duration):
+        """Stop sampling the calling thread; returns the profile path if one was written"""
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or duration < self.threshold:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "request"
+        path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{duration * 1000:.0f}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.profiles_written += 1
+        return path
+
+    def _sample(self):
+        sampler = threading.get_ident()
+        while self.enabled:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != sampler:
+                        samples[collapse(frame)] += 1
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "output_dir": self.output_dir,
+            "profiles_written": self.profiles_written,
+        }
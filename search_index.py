@@ -0,0 +1,195 @@
+"""Trigram index for case-insensitive substring search over names and artists.
+
+Every row's lowercase name and artists are split into character trigrams and
+each trigram maps to the sorted array of rows containing it. A query is
+answered by intersecting the posting lists of its trigrams (smallest first) and
+confirming the literal substring on the surviving rows, stopping at the
+requested limit. Queries shorter than a trigram fall back to a scan of the
+lowercase text buffers that also stops at the limit. Posting lists live in
+flat arrays so the index can be persisted and memory-mapped, and the lowercase
+texts are kept as compact.PackedStrings.
+"""
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from compact import PackedStrings
+
+GRAM = 3
+
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else ""
+
+
+def _grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def _fields(names, artists):
+    return {
+        "name": [_lower(value) for value in names],
+        "artists": [_lower(value) for value in artists],
+    }
+
+
+def _packed(fields):
+    return {field: PackedStrings._from_sequence(texts) for field, texts in fields.items()}
+
+
+def build_search_index(names, artists):
+    """Build the trigram index from parallel sequences of names and artists"""
+    fields = _fields(names, artists)
+
+    postings = defaultdict(list)
+    for row, (name, artist) in enumerate(zip(fields["name"], fields["artists"])):
+        for gram in _grams(name) | _grams(artist):
+            postings[gram].append(row)
+
+    # Posting lists are stored back to back, addressed through sorted grams
+    grams = sorted(postings)
+    offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+    np.cumsum([len(postings[gram]) for gram in grams], out=offsets[1:])
+    rows = np.fromiter((row for gram in grams for row in postings[gram]),
+                       dtype=np.int32, count=offsets[-1])
+
+    return {
+        "fields": _packed(fields),
+        "grams": np.array(grams, dtype=f"<U{GRAM}"),
+        "offsets": offsets,
+        "postings": rows,
+        "size": len(fields["name"]),
+    }
+
+
+def restore_search_index(names, artists, grams, offsets, postings, fields=None):
+    """Rebuild an index from the arrays of build_search_index (e.g. memory-mapped)
+
+    fields are its packed lowercase texts; when not given they are lowercased
+    again from names and artists.
+    """
+    if fields is None:
+        fields = _packed(_fields(names, artists))
+    return {
+        "fields": fields,
+        "grams": grams,
+        "offsets": offsets,
+        "postings": postings,
+        "size": len(fields["name"]),
+    }
+
+
+def add_rows(index, names, artists):
+    """Return a new index that also covers rows appended after the indexed ones.
+
+    Only the new rows are tokenized; they are merged into a copy of the
+    posting array with one insert, and index itself is left untouched.
+    """
+    start = index["size"]
+    new_fields = _fields(names, artists)
+    added = defaultdict(list)
+    for offset, (name, artist) in enumerate(zip(new_fields["name"], new_fields["artists"])):
+        for gram in _grams(name) | _grams(artist):
+            added[gram].append(start + offset)
+
+    old_grams = index["grams"]
+    old_counts = np.diff(index["offsets"])
+    new_grams = np.array(sorted(added), dtype=f"<U{GRAM}")
+    new_counts = np.array([len(added[gram]) for gram in sorted(added)], dtype=np.int64)
+
+    grams = np.union1d(old_grams, new_grams)
+    counts = np.zeros(len(grams), dtype=np.int64)
+    counts[np.searchsorted(grams, old_grams)] += old_counts
+    counts[np.searchsorted(grams, new_grams)] += new_counts
+    offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # New rows (with larger ids) go after the old rows of their gram, where
+    # the next old list starts, so every list stays sorted
+    new_rows = np.fromiter((row for gram in sorted(added) for row in added[gram]),
+                           dtype=np.int32, count=int(new_counts.sum()))
+    at = index["offsets"][np.searchsorted(old_grams, new_grams, side="right")]
+    postings = np.insert(index["postings"], np.repeat(at, new_counts), new_rows)
+
+    return {
+        "fields": {field: PackedStrings._concat_same_type([index["fields"][field], texts])
+                   for field, texts in _packed(new_fields).items()},
+        "grams": grams,
+        "offsets": offsets,
+        "postings": postings,
+        "size": start + len(new_fields["name"]),
+    }
+
+
+def _postings(index, gram):
+    grams = index["grams"]
+    i = np.searchsorted(grams, gram)
+    if i == len(grams) or grams[i] != gram:
+        return None
+    return index["postings"][index["offsets"][i]:index["offsets"][i + 1]]
+
+
+def _candidates(index, query):
+    """Return the rows that contain every trigram of query, in row order"""
+    lists = []
+    for gram in _grams(query):
+        rows = _postings(index, gram)
+        if rows is None:
+            return ()
+        lists.append(rows)
+
+    lists.sort(key=len)
+    rows = lists[0]
+    for other in lists[1:]:
+        if not len(rows):
+            break
+        rows = np.intersect1d(rows, other, assume_unique=True)
+    return rows
+
+
+def _scan(texts, query, limit):
+    """Return up to limit rows, in row order, whose text contains query.
+
+    Matches are found with a regex over the whole UTF-8 buffer, without
+    decoding rows; a match that spans two rows is skipped.
+    """
+    pattern = re.compile(re.escape(query.encode("utf-8")))
+    buffer = memoryview(texts.data)
+    offsets = texts.offsets
+    rows = []
+    position = int(offsets[0])
+    while len(rows) < limit:
+        match = pattern.search(buffer, position, int(offsets[-1]))
+        if match is None:
+            break
+        row = int(np.searchsorted(offsets, match.start(), side="right")) - 1
+        if match.end() <= offsets[row + 1]:
+            rows.append(row)
+            position = int(offsets[row + 1])
+        else:
+            position = match.start() + 1
+    return rows
+
+
+def search(index, query, limit=10, fields=("name", "artists")):
+    """Return up to limit row ids, in row order, whose fields contain query.
+
+    The query is matched as a literal, case-insensitive substring.
+    """
+    query = query.lower()
+    texts = [index["fields"][field] for field in fields]
+    if not query:
+        return []
+
+    if len(query) < GRAM:
+        return sorted(set(row for text in texts for row in _scan(text, query, limit)))[:limit]
+
+    candidates = _candidates(index, query)
+    matches = []
+    for row in candidates:
+        if any(query in text[row] for text in texts):
+            matches.append(int(row))
+            if len(matches) >= limit:
+                break
+    return matches
@@ -0,0 +1,69 @@
+"""Fast JSON responses built straight from column arrays.
+
+orjson is used when installed (it encodes NumPy scalars and arrays natively);
+otherwise the standard library encoder with a NumPy fallback. Responses are
+assembled from per-column NumPy arrays gathered by row, instead of building a
+DataFrame per request and boxing every cell through to_dict('records').
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Encode obj as compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_response(body, status=200):
+    """Return a Flask JSON response; body is an object or already-encoded bytes"""
+    if not isinstance(body, bytes):
+        body = dumps(body)
+    return Response(body, status=status, mimetype="application/json")
+
+
+def take_list(values, rows):
+    """Return values[rows] as a list of Python objects.
+
+    values is a NumPy array, a compact.PackedStrings or a pandas Categorical;
+    the latter two are read without building an intermediate array.
+    """
+    if hasattr(values, "take_list"):
+        return values.take_list(rows)
+    if isinstance(values, pd.Categorical):
+        return np.asarray(values.categories)[values.codes[rows]].tolist()
+    return values[rows].tolist()
+
+
+def gather(columns, rows, names, extra=None):
+    """Return {name: list} holding the given rows of each named column.
+
+    extra maps further column names to per-row values (e.g. similarities).
+    """
+    gathered = {name: take_list(columns[name], rows) for name in names}
+    for name, values in (extra or {}).items():
+        gathered[name] = np.asarray(values).tolist()
+    return gathered
+
+
+def records(gathered):
+    """Turn {name: list} columns into a list of per-row dicts"""
+    names = list(gathered)
+    return [dict(zip(names, row)) for row in zip(*gathered.values())]
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+import artifacts
+
+
+@pytest.fixture
+def arrays():
+    rs = np.random.RandomState(0)
+    return {
+        "vectors": rs.rand(50, 8).astype(np.float32),
+        "labels": rs.randint(0, 5, 50).astype(np.int16),
+        "codes": rs.randint(-128, 128, (50, 8)).astype(np.int8),
+    }
+
+
+def test_round_trip(tmp_path, arrays):
+    path = artifacts.save_artifacts(str(tmp_path), arrays, {"songs": 50, "nested": {"k": [1, 2]}})
+    loaded, metadata = artifacts.load_artifacts(str(tmp_path))
+    assert artifacts.resolve_artifacts(str(tmp_path)) == path
+    assert sorted(loaded) == sorted(arrays)
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(loaded[name], array)
+        assert loaded[name].dtype == array.dtype
+        assert isinstance(loaded[name], np.memmap)
+    assert metadata["songs"] == 50 and metadata["nested"] == {"k": [1, 2]}
+    assert metadata["version"] == os.path.basename(path)
+    assert metadata["format_version"] == artifacts.FORMAT_VERSION
+
+
+def test_loaded_arrays_are_read_only(tmp_path, arrays):
+    artifacts.save_artifacts(str(tmp_path), arrays, {})
+    loaded, _ = artifacts.load_artifacts(str(tmp_path))
+    with pytest.raises(ValueError):
+        loaded["vectors"][0, 0] = 1
+    in_memory, _ = artifacts.load_artifacts(str(tmp_path), mmap=False)
+    assert not isinstance(in_memory["vectors"], np.memmap)
+
+
+def test_versions_in_the_same_second_are_unique(tmp_path, arrays):
+    paths = [artifacts.save_artifacts(str(tmp_path), arrays, {"build": i}) for i in range(3)]
+    assert len(set(paths)) == 3
+    assert artifacts.resolve_artifacts(str(tmp_path)) == paths[-1]
+    for i, path in enumerate(paths):
+        assert artifacts.load_artifacts(path)[1]["build"] == i
+
+
+def test_prune_keeps_one_version(tmp_path, arrays):
+    paths = [artifacts.save_artifacts(str(tmp_path), arrays, {}) for _ in range(3)]
+    artifacts.prune_artifacts(str(tmp_path), keep=paths[1])
+    assert [path for path in paths if os.path.exists(path)] == [paths[1]]
+
+
+def test_unsupported_format_is_rejected(tmp_path, arrays):
+    path = artifacts.save_artifacts(str(tmp_path), arrays, {})
+    metadata_path = os.path.join(path, artifacts.METADATA_FILE)
+    with open(metadata_path) as f:
+        text = f.read()
+    with open(metadata_path, "w") as f:
+        f.write(text.replace(f'"format_version": {artifacts.FORMAT_VERSION}', '"format_version": 0'))
+    with pytest.raises(ValueError):
+        artifacts.load_artifacts(path)
+
+
+def test_strings_round_trip():
+    values = ["", "Café", "日本語", "plain"]
+    buffer, offsets = artifacts.encode_strings(values)
+    assert artifacts.decode_strings(buffer, offsets) == values
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import compact
+from compact import PackedStrings
+
+VALUES = ["Bohemian Rhapsody", "", "Café", "queen of hearts", "日本語", "Under Pressure"]
+
+
+@pytest.fixture
+def strings():
+    return PackedStrings._from_sequence(VALUES)
+
+
+def test_values_round_trip(strings):
+    assert list(strings) == VALUES
+    assert [strings[i] for i in range(len(VALUES))] == VALUES
+    assert strings[-1] == VALUES[-1]
+    assert list(np.asarray(strings)) == VALUES
+
+
+def test_take(strings):
+    assert list(strings.take([5, 0, 0, 2])) == [VALUES[5], VALUES[0], VALUES[0], VALUES[2]]
+    assert list(strings.take([-1, 1])) == [VALUES[-1], VALUES[1]]
+    assert list(strings.take([2, -1], allow_fill=True)) == [VALUES[2], ""]
+    assert strings.take_list([4, 3]) == [VALUES[4], VALUES[3]]
+    with pytest.raises(IndexError):
+        strings.take([len(VALUES)])
+
+
+def test_slices_share_the_buffer(strings):
+    part = strings[1:4]
+    assert list(part) == VALUES[1:4]
+    assert part.data is strings.data
+    assert list(strings[::2]) == VALUES[::2]
+    assert list(strings[np.array([True, False] * 3)]) == VALUES[::2]
+
+
+def test_concat(strings):
+    joined = PackedStrings._concat_same_type([strings[2:], strings[:2], PackedStrings._from_sequence([])])
+    assert list(joined) == VALUES[2:] + VALUES[:2]
+    assert list(pd.concat([pd.Series(strings), pd.Series(strings[:1])], ignore_index=True)) == VALUES + VALUES[:1]
+
+
+def test_equal_at(strings):
+    np.testing.assert_array_equal(strings.equal_at([2, 3, 2], "Café"), [True, False, True])
+
+
+def test_str_accessor(strings):
+    names = pd.DataFrame({"name": strings})["name"]
+    assert names.dtype == compact.PackedStringDtype()
+    assert names.str.contains("queen").tolist() == ["queen" in value for value in VALUES]
+    assert names.str.contains("QUEEN", case=False).tolist() == ["queen" in value.lower() for value in VALUES]
+    assert names.str.lower().tolist() == [value.lower() for value in VALUES]
+    assert names.str.len().tolist() == [len(value) for value in VALUES]
+    assert names[names.str.startswith("Under")].tolist() == ["Under Pressure"]
+
+
+def test_string_index(strings):
+    index = compact.build_string_index(strings)
+    for row, value in enumerate(VALUES):
+        assert compact.string_index_lookup(index, strings, value) == row
+    assert compact.string_index_lookup(index, strings, "missing") is None
+
+    more = PackedStrings._from_sequence(["New Song", "Another"])
+    extended = compact.string_index_add(index, more)
+    combined = PackedStrings._concat_same_type([strings, more])
+    assert compact.string_index_lookup(extended, combined, "Another") == len(VALUES) + 1
+    assert compact.string_index_lookup(extended, combined, "Café") == 2
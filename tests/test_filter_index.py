@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import filter_index
+
+ARTISTS = [f"['A{i}']" if i % 3 else f"['A{i}', 'A{i + 1}']" for i in range(40)] + ["Solo", "['O\\'Brien']"]
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rs = np.random.RandomState(0)
+    size = 3000
+    return (rs.randint(1950, 2020, size), np.array(ARTISTS, dtype=object)[rs.randint(0, len(ARTISTS), size)],
+            rs.randint(0, 100, size))
+
+
+def credited(artists, names):
+    return np.array([bool(filter_index.split_artists(value) & {name.lower() for name in names}) for value in artists])
+
+
+def test_added_rows_equal_a_full_build(catalog):
+    years, artists, popularity = catalog
+    built = filter_index.build_filter_index(years, artists, popularity)
+    added = filter_index.add_rows(filter_index.build_filter_index(years[:2000], artists[:2000], popularity[:2000]),
+                                  years[2000:], artists[2000:], popularity[2000:])
+    assert added["size"] == built["size"]
+    assert sorted(added["artist_values"]) == sorted(built["artist_values"])
+    for key in ("years", "popularity", "year_order", "years_sorted", "popularity_order", "popularity_sorted"):
+        np.testing.assert_array_equal(added[key], built[key])
+    for name in ("a7", "a8", "solo", "o'brien", "['a3', 'a4']"):
+        np.testing.assert_array_equal(np.sort(filter_index.artist_rows(added, [name])),
+                                      np.sort(filter_index.artist_rows(built, [name])))
+
+
+def test_added_rows_without_popularity(catalog):
+    years, artists, _ = catalog
+    added = filter_index.add_rows(filter_index.build_filter_index(years[:10], artists[:10]), years[10:], artists[10:])
+    assert added["popularity_order"] is None
+    np.testing.assert_array_equal(added["year_order"], filter_index.build_filter_index(years, artists)["year_order"])
+
+
+def test_filter_rows_match_a_scan(catalog):
+    years, artists, popularity = catalog
+    index = filter_index.build_filter_index(years, artists, popularity)
+    rs = np.random.RandomState(1)
+    for _ in range(300):
+        filters = {}
+        if rs.rand() < 0.5:
+            filters["year_min"] = int(rs.randint(1950, 2020))
+        if rs.rand() < 0.5:
+            filters["year_max"] = int(rs.randint(1950, 2020))
+        if rs.rand() < 0.4:
+            filters["min_popularity"] = int(rs.randint(0, 100))
+        if rs.rand() < 0.4:
+            filters["artists"] = [f"A{rs.randint(45)}" for _ in range(rs.randint(1, 3))]
+        if rs.rand() < 0.4:
+            filters["exclude_artists"] = [f"a{rs.randint(40)}"]
+
+        passes = np.ones(len(years), dtype=bool)
+        if "year_min" in filters:
+            passes &= years >= filters["year_min"]
+        if "year_max" in filters:
+            passes &= years <= filters["year_max"]
+        if "min_popularity" in filters:
+            passes &= popularity >= filters["min_popularity"]
+        if "artists" in filters:
+            passes &= credited(artists, filters["artists"])
+        excluded = credited(artists, filters.get("exclude_artists", []))
+
+        allowed, skipped = filter_index.filter_rows(index, **filters)
+        if set(filters) - {"exclude_artists"}:
+            assert skipped is None
+            np.testing.assert_array_equal(allowed, np.flatnonzero(passes & ~excluded))
+        else:
+            assert allowed is None
+            if "exclude_artists" in filters:
+                np.testing.assert_array_equal(skipped, np.flatnonzero(excluded))
+            else:
+                assert skipped is None
+
+
+def test_popularity_filter_needs_popularity(catalog):
+    years, artists, _ = catalog
+    with pytest.raises(ValueError):
+        filter_index.filter_rows(filter_index.build_filter_index(years, artists), min_popularity=10)
+
+
+def test_artist_names_split_list_literals():
+    assert filter_index.artist_names("['Queen', 'David Bowie']") == {"queen", "david bowie"}
+    assert filter_index.artist_names("ABBA") == {"abba"}
+    assert filter_index.split_artists("['A', 'B']") == {"a", "b", "['a', 'b']"}
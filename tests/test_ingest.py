@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import app
+
+SONGS = [
+    {"name": "Brand New Tune", "artists": "['Newcomer']", "year": 2024, "popularity": 40,
+     **{feature: 0.5 for feature in app.numerical_features}, "tempo": 120},
+    {"id": "fixed-id", "name": "Second Single", "artists": "['Newcomer', 'Guest']", "year": 2025,
+     **{feature: 0.2 for feature in app.numerical_features}, "tempo": 90},
+]
+
+
+@pytest.fixture
+def ingest_log(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "ingest.jsonl"
+    monkeypatch.setattr(app, "INGEST_LOG", str(path))
+    app.create_sample_data()
+    return path
+
+
+def served_ids():
+    return list(app.df["id"])
+
+
+def test_ingest_logs_and_serves_songs(ingest_log):
+    before = served_ids()
+    app.install_model(app.ingest_and_log(SONGS))
+    assert served_ids()[:len(before)] == before
+    assert len(served_ids()) == len(before) + 2
+    assert "fixed-id" in served_ids()
+    assert [json.loads(line)["name"] for line in ingest_log.read_text().splitlines()] == [song["name"] for song in SONGS]
+    assert app.search_index.search(app.song_search_index, "brand new")
+
+
+def test_replay_onto_a_fresh_model_restores_the_songs(ingest_log):
+    app.install_model(app.ingest_and_log(SONGS))
+    ingested = served_ids()
+    app.create_sample_data()
+    app.install_model(app.replay_ingest_log(app.served_snapshot()))
+    assert served_ids() == ingested
+
+
+def test_replay_is_idempotent(ingest_log):
+    app.install_model(app.ingest_and_log(SONGS))
+    app.install_model(app.ingest_and_log(SONGS))
+    ingested = served_ids()
+    served = app.df
+    for _ in range(2):
+        app.install_model(app.replay_ingest_log(app.served_snapshot()))
+        assert served_ids() == ingested
+    # Nothing new was logged, so the served catalog is reused rather than copied
+    assert app.df is served
+
+
+def test_replay_reads_only_new_whole_lines(ingest_log):
+    app.install_model(app.ingest_and_log(SONGS[:1]))
+    app.install_model(app.replay_ingest_log(app.served_snapshot()))
+    count = len(app.df)
+    # Another worker's song, then a line it is still writing
+    with open(ingest_log, "a") as f:
+        f.write(json.dumps(SONGS[1]) + "\n" + json.dumps(SONGS[0])[:10])
+    app.install_model(app.replay_ingest_log(app.served_snapshot()))
+    assert len(app.df) == count + 1
+    assert app.ingest_log_offset == ingest_log.read_bytes().rfind(b"\n") + 1
+
+
+def test_replay_without_a_log_changes_nothing(ingest_log):
+    snapshot = app.served_snapshot()
+    assert app.replay_ingest_log(snapshot) is snapshot
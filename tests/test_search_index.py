@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import search_index
+
+WORDS = ["Queen", "queen", "Bohemian", "a.b", "(x)", "c++", "[y]", "Café", "ÉTÉ", "ab", "la", "x", "?", "*"]
+QUERIES = ["a", "é", "x", ".", "+", "(", "c+", "la", "a.b", "(x)", "c++", "[y]", "que", "QUEEN",
+           "café", "été", "bohemian", "n q", "zzz", "mia", ".*", "a.*b", "?", "\\"]
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rs = np.random.RandomState(0)
+    names = [" ".join(rs.choice(WORDS, rs.randint(1, 4))) for _ in range(1500)]
+    artists = [str(list(rs.choice(WORDS, rs.randint(1, 3)))) for _ in range(1500)]
+    return pd.Series(names), pd.Series(artists)
+
+
+def scan(names, artists, query, fields=("name", "artists")):
+    """The rows a literal, case-insensitive str.contains scan finds"""
+    columns = {"name": names, "artists": artists}
+    found = np.zeros(len(names), dtype=bool)
+    for field in fields:
+        found |= columns[field].str.lower().str.contains(query.lower(), regex=False).to_numpy()
+    return list(np.flatnonzero(found))
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_search_matches_a_substring_scan(catalog, query):
+    names, artists = catalog
+    index = search_index.build_search_index(names, artists)
+    assert search_index.search(index, query, limit=len(names)) == scan(names, artists, query)
+    assert search_index.search(index, query, limit=len(names), fields=("name",)) == scan(names, artists, query, ("name",))
+
+
+@pytest.mark.parametrize("query", ["a", "que", "c++"])
+def test_search_stops_at_the_limit(catalog, query):
+    names, artists = catalog
+    index = search_index.build_search_index(names, artists)
+    assert search_index.search(index, query, limit=7) == scan(names, artists, query)[:7]
+
+
+def test_empty_query_finds_nothing(catalog):
+    index = search_index.build_search_index(*catalog)
+    assert search_index.search(index, "") == []
+
+
+def test_added_rows_equal_a_full_build(catalog):
+    names, artists = catalog
+    built = search_index.build_search_index(names, artists)
+    added = search_index.add_rows(search_index.build_search_index(names[:1000], artists[:1000]),
+                                  names[1000:], artists[1000:])
+    for key in ("grams", "offsets", "postings"):
+        np.testing.assert_array_equal(added[key], built[key])
+    assert added["size"] == built["size"]
+    for query in QUERIES:
+        assert search_index.search(added, query, limit=2000) == scan(names, artists, query)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from sklearn.cluster import KMeans
+
+import vector_index
+
+
+@pytest.fixture(scope="module")
+def features():
+    rs = np.random.RandomState(0)
+    centers = rs.randn(12, 8) * 3
+    return (centers[rs.randint(0, len(centers), 3000)] + rs.randn(3000, 8)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def index(features):
+    kmeans = KMeans(n_clusters=16, random_state=0, n_init=1).fit(features)
+    return vector_index.build_ivf_index(vector_index.normalize_rows(features), kmeans.cluster_centers_, kmeans.labels_)
+
+
+def brute_force(features, query, k, rows=None):
+    vectors = vector_index.normalize_rows(features)
+    query = query / np.linalg.norm(query)
+    rows = np.arange(len(vectors)) if rows is None else rows
+    scores = vectors[rows] @ query
+    return rows[np.argsort(-scores, kind="stable")[:k]]
+
+
+def test_exact_search_matches_brute_force(features, index):
+    for row in range(0, 3000, 150):
+        ids, scores = vector_index.search(index, features[row], 10, exact=True)
+        assert list(ids) == list(brute_force(features, features[row], 10))
+        assert np.all(np.diff(scores) <= 0)
+
+
+def test_probing_every_list_is_exact(features, index):
+    for row in range(0, 3000, 300):
+        exact, _ = vector_index.search(index, features[row], 10, exact=True)
+        probed, _ = vector_index.search(index, features[row], 10, probes=len(index["centroids"]))
+        assert list(probed) == list(exact)
+
+
+def test_recall_against_exact_search(features, index):
+    queries = [(row, features[row]) for row in range(0, 3000, 30)]
+    assert vector_index.recall_at_k(index, queries, 10, probes=4) >= 0.9
+
+
+def test_int8_rerank_keeps_recall_and_float_scores(features, index):
+    quantized = vector_index.quantize_index(index)
+    queries = [(row, features[row]) for row in range(0, 3000, 30)]
+    float_recall = vector_index.recall_at_k(index, queries, 10, probes=4)
+    assert vector_index.recall_at_k(quantized, queries, 10, probes=4, rerank=4) >= float_recall - 0.02
+
+    ids, scores = vector_index.search(quantized, features[7], 10, probes=4, rerank=4)
+    unit_query = features[7] / np.linalg.norm(features[7])
+    np.testing.assert_allclose(scores, index["vectors"][ids] @ unit_query, rtol=1e-5)
+
+
+def test_search_only_returns_allowed_rows(features, index):
+    rs = np.random.RandomState(1)
+    for size in (5, 40, 2500):
+        allowed = np.sort(rs.choice(3000, size, replace=False))
+        ids, _ = vector_index.search(index, features[3], 10, probes=2, allowed=allowed)
+        assert np.isin(ids, allowed).all()
+        assert len(ids) == min(10, size)
+        exact, _ = vector_index.search(index, features[3], 10, exact=True, allowed=allowed)
+        assert list(exact) == list(brute_force(features, features[3], 10, allowed))
+
+
+def test_search_skips_excluded_rows(features, index):
+    ids, _ = vector_index.search(index, features[11], 10, exact=True, exclude=[11])
+    assert 11 not in ids
+    assert list(ids) == list(brute_force(features, features[11], 11)[1:])
+
+
+def test_batch_search_matches_single_searches(features, index):
+    rows = np.arange(0, 3000, 97)
+    batch = vector_index.search_batch(index, features[rows], 5, probes=3, exclude=rows, block_scores=1 << 10)
+    for row, (ids, scores) in zip(rows, batch):
+        single_ids, single_scores = vector_index.search(index, features[row], 5, probes=3, exclude=[row])
+        assert list(ids) == list(single_ids)
+        np.testing.assert_allclose(scores, single_scores, rtol=1e-5)
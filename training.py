@@ -0,0 +1,74 @@
+"""Streaming model training for catalogs too large to cluster in memory.
+
+The catalog (columnar directory or CSV) is read in fixed-size chunks: one pass
+fits the StandardScaler incrementally, the next passes fit MiniBatchKMeans with
+partial_fit, and a final pass assigns every row to its cluster. Peak memory is
+bounded by the chunk size rather than the catalog size.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+
+import catalog
+
+
+def iter_feature_chunks(source, features, chunksize):
+    """Yield float64 feature matrices of up to chunksize rows from source"""
+    if catalog.is_catalog(source):
+        rows = catalog.read_manifest(source)["rows"]
+        for start in range(0, rows, chunksize):
+            chunk = catalog.read_catalog(source, columns=features,
+                                         rows=slice(start, start + chunksize))
+            yield chunk.to_numpy(dtype=np.float64)
+    else:
+        for chunk in pd.read_csv(source, usecols=features, chunksize=chunksize):
+            yield chunk[features].to_numpy(dtype=np.float64)
+
+
+def _stream(label, chunks, step, log):
+    """Apply step to every chunk, logging throughput; returns rows processed"""
+    rows = 0
+    started = time.perf_counter()
+    for chunk in chunks:
+        step(chunk)
+        rows += len(chunk)
+        elapsed = time.perf_counter() - started
+        log(f"  {label}: {rows} rows, {rows / elapsed if elapsed else 0:,.0f} rows/sec")
+    return rows
+
+
+def fit_streaming(source, features, n_clusters, chunksize=100_000, epochs=1,
+                  random_state=42, init=None, log=print):
+    """Fit a scaler and clustering over source in bounded memory.
+
+    init optionally gives starting centroids in the scaled space. Returns
+    (scaler, kmeans, labels) where labels holds the cluster of every row of
+    source in file order.
+    """
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+
+    started = time.perf_counter()
+    scaler = StandardScaler()
+    rows = _stream("scaler", iter_feature_chunks(source, features, chunksize),
+                   scaler.partial_fit, log)
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state)
+    if init is not None:
+        kmeans.set_params(init=init, n_init=1)
+    for epoch in range(epochs):
+        _stream(f"kmeans epoch {epoch + 1}/{epochs}",
+                iter_feature_chunks(source, features, chunksize),
+                lambda chunk: kmeans.partial_fit(scaler.transform(chunk)), log)
+
+    labels = []
+    _stream("assign", iter_feature_chunks(source, features, chunksize),
+            lambda chunk: labels.append(kmeans.predict(scaler.transform(chunk))), log)
+
+    elapsed = time.perf_counter() - started
+    log(f"Trained on {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:,.0f} rows/sec)")
+    return scaler, kmeans, np.concatenate(labels).astype(np.int32) if labels else np.empty(0, np.int32)
@@ -0,0 +1,439 @@
+"""Inverted-file (IVF) vector index used by recommend_songs.
+
+Rows are bucketed by their nearest coarse centroid (the KMeans centroids) and
+stored contiguously per bucket, so a query only scores the rows of the
+`probes` lists whose centroids are closest to it, so songs near a cluster
+boundary also find their neighbours across it. Scores are cosine
+similarities computed as dot products over unit-normalized float32 vectors.
+An exact mode scans every row and is kept for verifying recall.
+
+A quantized index (quantize_index) stores the lists as int8 codes, a quarter
+of the float32 size, and scores them approximately; the best `rerank` x k
+candidates are then re-scored exactly from the float vectors, so the ranking
+returned is exact over that shortlist.
+"""
+import time
+
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """Return a contiguous float32 copy of matrix with unit-length rows"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_ivf_index(unit_vectors, centroids, labels):
+    """Build an IVF index from unit-normalized vectors and their cluster labels.
+
+    unit_vectors is used as-is (see normalize_rows); centroids stay in the
+    unnormalized scaled space that queries are probed in.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+    # Group rows by list so every list is one contiguous slice
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=len(centroids))
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return {
+        "centroids": centroids,
+        "vectors": unit_vectors,
+        "list_vectors": unit_vectors[order],
+        "list_ids": order,
+        "offsets": offsets,
+    }
+
+
+def quantize(unit_vectors, low=None, scale=None):
+    """Scalar-quantize vectors to int8 codes with one affine step per dimension.
+
+    Returns (codes, low, scale), where vectors ~= low + scale * (codes + 128).
+    low and scale span the data unless given (to encode new rows for an
+    existing index); values outside that range are clipped.
+    """
+    unit_vectors = np.asarray(unit_vectors, dtype=np.float32)
+    if low is None:
+        if len(unit_vectors):
+            low, high = unit_vectors.min(axis=0), unit_vectors.max(axis=0)
+        else:
+            low = high = np.zeros(unit_vectors.shape[1], dtype=np.float32)
+        scale = np.maximum((high - low) / 255, np.finfo(np.float32).tiny)
+    codes = np.clip(np.rint((unit_vectors - low) / scale) - 128, -128, 127).astype(np.int8)
+    return codes, np.asarray(low, dtype=np.float32), np.asarray(scale, dtype=np.float32)
+
+
+def quantize_index(index):
+    """Return a copy of index whose lists hold int8 codes instead of float32 vectors"""
+    codes, low, scale = quantize(index["list_vectors"])
+    quantized = {key: value for key, value in index.items() if key != "list_vectors"}
+    quantized.update(list_codes=codes, code_low=low, code_scale=scale)
+    return quantized
+
+
+def unquantize_index(index):
+    """Return a float32 copy of an index, quantized or not"""
+    if "list_codes" not in index:
+        return index
+    unquantized = {key: value for key, value in index.items()
+                   if key not in ("list_codes", "code_low", "code_scale")}
+    if "list_vectors" not in unquantized:
+        unquantized["list_vectors"] = np.asarray(index["vectors"], dtype=np.float32)[index["list_ids"]]
+    return unquantized
+
+
+def list_nbytes(index):
+    """Bytes held by the list vectors (or codes) that IVF search scans"""
+    return index["list_codes" if "list_codes" in index else "list_vectors"].nbytes
+
+
+def _approximate_scores(index, codes, unit_queries):
+    """Dot products of unit_queries (rows) with int8-coded vectors; returns len(codes) x len(unit_queries)"""
+    weights = unit_queries * index["code_scale"]
+    shift = unit_queries @ (index["code_low"] + 128 * index["code_scale"])
+    return codes.astype(np.float32) @ weights.T + shift
+
+
+def add_vectors(index, unit_vectors, labels):
+    """Return a new index that also holds unit_vectors, appended as the next row ids.
+
+    New rows go to the end of their lists, so existing lists are copied in
+    order instead of re-sorting every row; index itself is left untouched.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    first_id = len(index["vectors"])
+    old_counts = np.diff(index["offsets"])
+    new_counts = np.bincount(labels, minlength=len(old_counts))
+    offsets = np.zeros(len(old_counts) + 1, dtype=np.int64)
+    np.cumsum(old_counts + new_counts, out=offsets[1:])
+
+    # Destination of every existing list entry, then of the new rows
+    owner = np.repeat(np.arange(len(old_counts)), old_counts)
+    old_slots = offsets[owner] + np.arange(len(owner)) - index["offsets"][owner]
+    order = np.argsort(labels, kind="stable")
+    new_starts = np.zeros(len(new_counts), dtype=np.int64)
+    np.cumsum(new_counts[:-1], out=new_starts[1:])
+    sorted_labels = labels[order]
+    new_slots = (offsets[sorted_labels] + old_counts[sorted_labels]
+                 + np.arange(len(order)) - new_starts[sorted_labels])
+
+    list_ids = np.empty(offsets[-1], dtype=np.int64)
+    list_ids[old_slots] = index["list_ids"]
+    list_ids[new_slots] = first_id + order
+
+    extended = dict(index, vectors=np.concatenate([index["vectors"], unit_vectors]),
+                    list_ids=list_ids, offsets=offsets)
+    if "list_codes" in index:
+        # New rows are coded with the existing steps, so old codes stay valid
+        new_lists, key = quantize(unit_vectors, index["code_low"], index["code_scale"])[0], "list_codes"
+    else:
+        new_lists, key = np.asarray(unit_vectors, dtype=np.float32), "list_vectors"
+    lists = np.empty((offsets[-1], index["vectors"].shape[1]), dtype=index[key].dtype)
+    lists[old_slots] = index[key]
+    lists[new_slots] = new_lists[order]
+    extended[key] = lists
+    return extended
+
+
+def nearest_lists(index, vectors):
+    """Return (nearest list, squared distance to its centroid) for every vector.
+
+    Equivalent to KMeans.predict against the index centroids.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    centroids = index["centroids"]
+    distances = ((vectors ** 2).sum(axis=1)[:, None] - 2 * vectors @ centroids.T
+                 + (centroids ** 2).sum(axis=1)[None, :])
+    nearest = distances.argmin(axis=1)
+    return nearest, np.maximum(distances[np.arange(len(vectors)), nearest], 0)
+
+
+def probe_lists(index, query, probes, ratio=None):
+    """Return the ids of the `probes` lists whose centroids are nearest to query.
+
+    With ratio, lists after the nearest one are only probed if their centroid
+    is at most ratio times as far as the nearest centroid, so queries deep
+    inside a cluster scan fewer lists than queries near a boundary.
+    """
+    distances = ((index["centroids"] - query) ** 2).sum(axis=1)
+    probes = max(1, min(int(probes), len(distances)))
+    if probes == 1:
+        return np.array([np.argmin(distances)])
+    nearest = np.argpartition(distances, probes - 1)[:probes]
+    nearest = nearest[np.argsort(distances[nearest])]
+    if ratio:
+        nearest = nearest[distances[nearest] <= ratio ** 2 * distances[nearest[0]]]
+    return nearest
+
+
+def _candidates(index, lists):
+    """Return (vectors, row ids) for the rows stored in the given lists; vectors are codes if quantized"""
+    offsets = index["offsets"]
+    stored = index["list_codes" if "list_codes" in index else "list_vectors"]
+    if len(lists) == 1:
+        start, end = offsets[lists[0]], offsets[lists[0] + 1]
+        return stored[start:end], index["list_ids"][start:end]
+    slices = [slice(offsets[l], offsets[l + 1]) for l in lists]
+    return (np.concatenate([stored[s] for s in slices]),
+            np.concatenate([index["list_ids"][s] for s in slices]))
+
+
+def _sorted_contains(sorted_values, values):
+    """Return whether each of values is in the sorted array sorted_values"""
+    at = np.minimum(np.searchsorted(sorted_values, values), max(len(sorted_values) - 1, 0))
+    return sorted_values[at] == values if len(sorted_values) else np.zeros(len(values), dtype=bool)
+
+
+def search(index, query, k, probes=1, exact=False, exclude=None, ratio=None, timings=None,
+           allowed=None, rerank=4):
+    """Return (row ids, similarities) of the top-k rows most similar to query.
+
+    query is a vector in the scaled feature space. With exact=True every row is
+    scored; otherwise only rows in the lists chosen by probe_lists(probes,
+    ratio) are. Row ids in exclude are never returned. If timings is a dict,
+    the seconds spent selecting candidates and scoring them are stored in it.
+
+    allowed optionally holds the sorted row ids that may be returned (see
+    filter_index.filter_rows). When they are fewer than the probed lists
+    hold, or the probed lists yield fewer than k of them, just the allowed
+    rows are scored instead, so a filter never costs a scan of the whole
+    catalog.
+
+    On a quantized index the probed lists are scored from their codes and the
+    best rerank * k candidates re-scored from the float vectors; exact and
+    filtered scans always use the float vectors.
+    """
+    started = time.perf_counter()
+    query = np.asarray(query, dtype=np.float32).ravel()
+    norm = np.linalg.norm(query)
+    unit_query = query / norm if norm else query
+    allowed_rows = None if allowed is None else np.asarray(allowed, dtype=np.int64)
+    coded = False
+
+    if allowed_rows is not None and exact:
+        vectors, ids = index["vectors"][allowed_rows], allowed_rows
+    elif exact:
+        vectors = index["vectors"]
+        ids = np.arange(len(vectors))
+    else:
+        lists = probe_lists(index, query, probes, ratio)
+        if allowed_rows is not None and len(allowed_rows) <= np.diff(index["offsets"])[lists].sum():
+            vectors, ids = index["vectors"][allowed_rows], allowed_rows
+        else:
+            vectors, ids = _candidates(index, lists)
+            coded = "list_codes" in index
+    selected = time.perf_counter()
+
+    def score(vectors, ids, coded=False):
+        if coded:
+            scores = _approximate_scores(index, vectors, unit_query[None, :])[:, 0]
+        else:
+            scores = vectors @ unit_query
+        if allowed_rows is not None and ids is not allowed_rows:
+            scores[~_sorted_contains(allowed_rows, ids)] = -np.inf
+        if exclude is not None:
+            scores[np.isin(ids, exclude)] = -np.inf
+        return scores
+
+    scores = score(vectors, ids, coded)
+    if ids is not allowed_rows and allowed_rows is not None and np.isfinite(scores).sum() < k:
+        # Too few allowed rows in the probed lists; score every allowed row
+        ids = allowed_rows
+        scores = score(index["vectors"][ids], ids)
+        coded = False
+
+    if coded:
+        # Re-score the best approximate candidates from the float vectors
+        shortlist = min(len(scores), max(k, 1) * rerank)
+        top = np.argpartition(-scores, shortlist - 1)[:shortlist] if shortlist else np.empty(0, dtype=np.int64)
+        top = top[np.isfinite(scores[top])]
+        ids = ids[top]
+        scores = np.asarray(index["vectors"][ids], dtype=np.float32) @ unit_query
+
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        top = np.empty(0, dtype=np.int64)
+    else:
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+    if timings is not None:
+        timings["candidates"] = selected - started
+        timings["scoring"] = time.perf_counter() - selected
+    return ids[top], scores[top]
+
+
+def _top_k_rows(scores, k):
+    """Return the column positions of the k best scores of every row, best first"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def blocked_top_k(vectors, query_rows, k, block_size=65536):
+    """Exact top-k neighbours of the given rows among all rows of vectors.
+
+    vectors are unit-normalized, so scores are cosine similarities; a row is
+    never its own neighbour. The catalog is scanned block_size rows at a time
+    and each block's best are merged into a running top-k, so memory stays at
+    len(query_rows) x block_size scores however large vectors is. Returns
+    (neighbour rows, scores), each len(query_rows) x k and best first; slots
+    beyond the catalog size hold -1 and -inf.
+    """
+    query_rows = np.asarray(query_rows, dtype=np.int64)
+    queries = np.asarray(vectors[query_rows], dtype=np.float32)
+    best_rows = np.full((len(query_rows), k), -1, dtype=np.int64)
+    best_scores = np.full((len(query_rows), k), -np.inf, dtype=np.float32)
+
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        scores = queries @ block.T
+        own = (query_rows >= start) & (query_rows < start + len(block))
+        scores[np.flatnonzero(own), query_rows[own] - start] = -np.inf
+
+        top = _top_k_rows(scores, k)
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        merged_rows = np.concatenate([best_rows, top + start], axis=1)
+        keep = _top_k_rows(merged_scores, k)
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+
+    best_rows[~np.isfinite(best_scores)] = -1
+    return best_rows, best_scores
+
+
+def search_batch(index, queries, k, probes=1, exact=False, exclude=None, ratio=None, rerank=4,
+                 block_scores=1 << 22):
+    """Batched search; returns one (row ids, similarities) pair per query.
+
+    Queries that probe the same lists are scored together with matrix-matrix
+    products, in chunks of queries sized so that no chunk scores more than
+    block_scores (query, row) pairs; memory is therefore bounded whatever the
+    batch size. exclude optionally gives one row id per query that must not
+    be returned for it (e.g. the query song itself). A quantized index is
+    re-ranked as in search.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit_queries = queries / norms
+    exclude = None if exclude is None else np.asarray(exclude)
+
+    if exact:
+        groups = {None: np.arange(len(queries))}
+    else:
+        groups = {}
+        for i, query in enumerate(queries):
+            lists = tuple(sorted(probe_lists(index, query, probes, ratio).tolist()))
+            groups.setdefault(lists, []).append(i)
+
+    results = [None] * len(queries)
+    for lists, group in groups.items():
+        group = np.asarray(group)
+        coded = False
+        if lists is None:
+            vectors = index["vectors"]
+            ids = np.arange(len(vectors))
+        else:
+            vectors, ids = _candidates(index, np.asarray(lists))
+            coded = "list_codes" in index
+
+        chunk = max(1, block_scores // max(len(ids), 1))
+        for start in range(0, len(group), chunk):
+            members = group[start:start + chunk]
+            _search_chunk(index, vectors, ids, coded, unit_queries, members, k, exclude, rerank, results)
+    return results
+
+
+def _search_chunk(index, vectors, ids, coded, unit_queries, members, k, exclude, rerank, results):
+    """Score the queries at members against one group's rows; fills results"""
+    if coded:
+        scores = _approximate_scores(index, vectors, unit_queries[members]).T
+    else:
+        scores = unit_queries[members] @ vectors.T
+    if exclude is not None:
+        scores[ids[None, :] == exclude[members][:, None]] = -np.inf
+
+    top = _top_k_rows(scores, max(k, 1) * rerank if coded else k)
+    for row, i in enumerate(members):
+        best = top[row]
+        best = best[np.isfinite(scores[row, best])]
+        if coded:
+            # Re-score the shortlist from the float vectors
+            shortlist = ids[best]
+            exact_scores = np.asarray(index["vectors"][shortlist], dtype=np.float32) @ unit_queries[i]
+            order = np.argsort(-exact_scores, kind="stable")[:k]
+            results[i] = (shortlist[order], exact_scores[order])
+        else:
+            results[i] = (ids[best], scores[row, best])
+
+
+def mmr(vectors, relevance, k, diversity=0.3, groups=None, max_per_group=None):
+    """Pick up to k rows by maximal marginal relevance; returns their positions in pick order.
+
+    Each pick maximizes (1 - diversity) * relevance - diversity * (highest
+    similarity to the rows picked so far), so diversity=0 keeps the relevance
+    order. vectors are the candidates' unit vectors. With groups and
+    max_per_group, at most max_per_group picks share a group. groups is either
+    one integer code per candidate or a boolean (candidates x groups) matrix
+    for candidates in several groups, e.g. songs credited to several artists.
+    Every pick costs one matrix-vector product over the candidates.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    k = min(k, len(relevance))
+    # Cosine similarity is at least -1, so this is below every real redundancy
+    redundancy = np.full(len(relevance), -1.0, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    if groups is not None and max_per_group:
+        groups = np.asarray(groups)
+        if groups.ndim == 1:
+            codes = groups
+            groups = np.zeros((len(codes), codes.max() + 1 if len(codes) else 0), dtype=bool)
+            groups[np.arange(len(codes)), codes] = True
+        group_counts = np.zeros(groups.shape[1], dtype=np.int64)
+
+    picks = []
+    for _ in range(k):
+        scores = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        if not available[best]:
+            break
+        picks.append(best)
+        available[best] = False
+        np.maximum(redundancy, vectors @ vectors[best], out=redundancy)
+        if groups is not None and max_per_group:
+            group_counts += groups[best]
+            full = groups[best] & (group_counts >= max_per_group)
+            if full.any():
+                available &= ~groups[:, full].any(axis=1)
+    return np.array(picks, dtype=np.int64)
+
+
+def recall_at_k(index, queries, k, probes=1, exclude_self=True, ratio=None, rerank=4):
+    """Measure mean recall@k of IVF search against exact search.
+
+    queries is an iterable of (row id, scaled vector) pairs; useful for choosing
+    a probe count that trades latency for recall.
+    """
+    hits = 0
+    total = 0
+    for row_id, query in queries:
+        exclude = [row_id] if exclude_self else None
+        expected, _ = search(index, query, k, exact=True, exclude=exclude)
+        found, _ = search(index, query, k, probes=probes, exclude=exclude, ratio=ratio, rerank=rerank)
+        hits += len(np.intersect1d(expected, found))
+        total += len(expected)
+    return hits / total if total else 1.0
+
+
+def scan_fraction(index, queries, probes=1, ratio=None):
+    """Mean fraction of the catalog scored per query in IVF mode"""
+    sizes = np.diff(index["offsets"])
+    scanned = [sizes[probe_lists(index, query, probes, ratio)].sum() for query in queries]
+    return float(np.mean(scanned)) / max(len(index["vectors"]), 1) if scanned else 0.0